@@ -1,19 +1,107 @@
 import logging
+import math
 import sys
 import time
 from datetime import datetime
-from typing import List
+from heapq import heappush, heappop
+from itertools import count
+from typing import List, Dict, Callable, Any, Tuple
 from abc import ABC, abstractmethod
-from threading import Thread, Lock
-
+from threading import Thread, Lock, Condition, local
+from contextlib import contextmanager
+from concurrent.futures import Future
+from dataclasses import dataclass
+from position_journal import PositionJournal
+from speed_profile import SpeedProfile
+from motion_profile import MotionProfile, FULL_SPEED
+from clock import Clock, VirtualClock, SYSTEM_CLOCK
+from metrics import Metrics, Histogram
+from trace_recorder import Tracer, TraceEvent
+
+
+
+
+class MoveOutcome:
+    REACHED = "reached"
+    SUPERSEDED = "superseded"
+
+
+@dataclass(frozen=True)
+class MotionPlan:
+    # clients can interpolate the current position between start and end time
+    start_position: int
+    target_position: int
+    start_time: float   # epoch sec
+    end_time: float     # epoch sec
+    sec_per_slot: float
+
+
+@dataclass(frozen=True)
+class AwningState:
+    position: int
+    current_position: int
+    is_target_reached: bool
+    is_moving_forward: bool
+    is_moving_backward: bool
+
+
+class NotificationHub:
+    __default = None
+
+    def __init__(self, window_sec: float = 0.25, name: str = "notification_hub", metrics: Metrics = None):
+        self.window_sec = window_sec
+        self.__pending = dict()
+        self.__condition = Condition()
+        metrics = Metrics.default() if metrics is None else metrics
+        self.__fan_out_sec = metrics.histogram("awning_listener_fan_out_seconds", "time to notify the listeners of a state change", {"hub": name})
+        Thread(name=name, target=self.__run, daemon=True).start()
+
+    @staticmethod
+    def default():
+        if NotificationHub.__default is None:
+            NotificationHub.__default = NotificationHub()
+        return NotificationHub.__default
+
+    def submit(self, awning):
+        with self.__condition:
+            # bursts within the window are coalesced into a single delivery
+            if awning not in self.__pending:
+                self.__pending[awning] = time.monotonic_ns() + int(self.window_sec * 1_000_000_000)
+                self.__condition.notify()
+
+    def __next_awning(self):
+        with self.__condition:
+            while True:
+                if len(self.__pending) > 0:
+                    # all entries share the same window. The oldest entry is the first one to be due
+                    awning, due_ns = next(iter(self.__pending.items()))
+                    timeout_ns = due_ns - time.monotonic_ns()
+                    if timeout_ns <= 0:
+                        del self.__pending[awning]
+                        return awning
+                    self.__condition.wait(timeout_ns / 1_000_000_000)
+                else:
+                    self.__condition.wait()
 
+    def __run(self):
+        while True:
+            awning = self.__next_awning()
+            start_ns = time.perf_counter_ns()
+            try:
+                awning._deliver_notification()
+            except Exception as e:
+                logging.warning("error occurred on notifying listeners of " + awning.name + " " + str(e))
+            self.__fan_out_sec.observe((time.perf_counter_ns() - start_ns) / 1_000_000_000)
 
 
 class Awning(ABC):
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, hub: NotificationHub = None):
         self.__name = name
         self.__listeners = set()
+        self.__hub = NotificationHub.default() if hub is None else hub
+        self.__last_state = None
+        self.__versioned_state = (0, None)
 
     @property
     def name(self) -> str:
@@ -28,7 +116,13 @@ class Awning(ABC):
         pass
 
     @abstractmethod
-    def set_position(self, new_position: int):
+    def set_position(self, new_position: int, until_reached: bool = False) -> Future:
+        # the returned future resolves with the applied target position or, if until_reached is set,
+        # with the MoveOutcome as soon as the target is reached or superseded by another command
+        pass
+
+    @abstractmethod
+    def eta_seconds(self) -> float:
         pass
 
     @abstractmethod
@@ -43,18 +137,43 @@ class Awning(ABC):
     def stop(self):
         pass
 
+    def get_state(self) -> AwningState:
+        position = self.get_position()
+        return AwningState(position, position, self.is_target_reached(), self.is_moving_forward(), self.is_moving_backward())
+
+    def get_motion_plan(self) -> MotionPlan:
+        state = self.get_state()
+        now = time.time()
+        return MotionPlan(state.current_position, state.position, now, now + self.eta_seconds(), 0)
+
     def add_listener(self, listener):
         self.__listeners.add(listener)
 
+    def remove_listener(self, listener):
+        self.__listeners.discard(listener)
+
     def _notify_listeners(self):
-        for listener in self.__listeners:
-            listener()
+        self.__hub.submit(self)
+
+    def _deliver_notification(self):
+        # called by the notification hub thread, outside of any movement lock
+        state = self.get_state()
+        if state != self.__last_state:
+            self.__last_state = state
+            self.__versioned_state = (self.__versioned_state[0] + 1, state)
+            for listener in list(self.__listeners):
+                listener()
+
+    def get_versioned_state(self) -> Tuple[int, AwningState]:
+        # the last notified state and its monotonically increasing version
+        return self.__versioned_state
 
 
 class Motor(ABC):
 
     @abstractmethod
-    def terminate(self):
+    def terminate(self, kept_pins: List[int] = ()):
+        # releases the pins of the motor except the kept ones, which have been taken over by a replacing motor
         pass
 
     @abstractmethod
@@ -79,12 +198,34 @@ class Motor(ABC):
     def sec_per_step(self) -> float:
         pass
 
+    @property
+    def start_latency_sec(self) -> float:
+        return 0
+
+    @property
+    def speed_profile(self) -> SpeedProfile:
+        return SpeedProfile.constant(self.sec_per_step)
+
+    @property
+    def motion_profile(self) -> MotionProfile:
+        return FULL_SPEED
+
+    @property
+    def pins(self) -> List[int]:
+        return []
+
+    def set_speed(self, duty: float):
+        # motors without speed control run at full speed
+        pass
+
 
 class Movement:
-    SLOT_TOLERANCE = 7
+    __slots__ = ('awning', 'motor', 'start_pos', 'num_slots', 'sec_per_slot', 'direction', 'target_pos', 'speed_profile', 'slot_tolerance',
+                 'duty_plan', 'clock', 'start_time_ns', 'run_start_time_ns', 'end_time_ns', 'motion_plan')
 
-    def __init__(self, motor: Motor, start_pos: int, num_slots: int, sec_per_slot: float, is_positive: bool, awning):
-        self.start_time = datetime.now()
+    def __init__(self, motor: Motor, start_pos: int, num_slots: int, sec_per_slot: float, is_positive: bool, awning, running_duty: float = 0):
+        self.clock = awning.clock
+        self.start_time_ns = self.clock.monotonic_ns()
         self.awning = awning
         self.motor = motor
         self.start_pos = start_pos
@@ -94,9 +235,19 @@ class Movement:
             self.direction = 1
         else:
             self.direction = -1
-
-    def get_pause_sec(self):
-        return 0.5
+        self.target_pos = start_pos + (num_slots * self.direction)
+        self.speed_profile = motor.speed_profile
+        motion_profile = motor.motion_profile
+        self.slot_tolerance = motion_profile.slot_tolerance
+        # the position integrates the duty cycles of the motion profile over the speed profile
+        self.duty_plan = motion_profile.plan(self.speed_profile, start_pos, num_slots, self.direction, running_duty)
+        # the motor needs some time to start. Slots are counted after the start latency
+        start_latency_ns = int(motor.start_latency_sec * 1_000_000_000) if num_slots > 0 else 0
+        self.run_start_time_ns = self.start_time_ns + start_latency_ns
+        self.end_time_ns = self.run_start_time_ns + self.duty_plan.travel_ns
+        run_start_time = self.clock.time() + (start_latency_ns / 1_000_000_000)
+        travel_sec = (self.end_time_ns - self.run_start_time_ns) / 1_000_000_000
+        self.motion_plan = MotionPlan(start_pos, self.target_pos, run_start_time, run_start_time + travel_sec, travel_sec / num_slots if num_slots > 0 else sec_per_slot)
 
     def is_moving_forward(self) -> bool:
         return False
@@ -105,69 +256,108 @@ class Movement:
         return False
 
     def get_current_pos(self) -> int:
-        if self.is_target_reached():
-            return self.get_target_pos()
+        now_ns = self.clock.monotonic_ns()
+        if now_ns >= self.end_time_ns:
+            return self.target_pos
         else:
-            return self.start_pos + (self.__get_num_processed_slots() * self.direction)
+            num_processed_slots, _ = self.speed_profile.num_slots_after(self.start_pos, self.direction, self.duty_plan.progress_ns(now_ns - self.run_start_time_ns))
+            return self.start_pos + (min(num_processed_slots, self.num_slots) * self.direction)
 
     def get_target_pos(self) -> int:
-        return self.start_pos + (self.num_slots * self.direction)
+        return self.target_pos
 
     def is_target_reached(self) -> bool:
-        return self.__get_num_processed_slots() >= self.num_slots
+        return self.clock.monotonic_ns() >= self.end_time_ns
 
-    def __get_num_processed_slots(self) -> int:
-        elapsed_sec = (datetime.now() - self.start_time).total_seconds()
-        num_processed = 0
-        if elapsed_sec > 1:
-            num_processed = elapsed_sec / self.sec_per_slot
-        return int(num_processed)
+    def eta_seconds(self) -> float:
+        remaining_ns = self.end_time_ns - self.clock.monotonic_ns()
+        return max(0, remaining_ns) / 1_000_000_000
+
+    def get_lost_slot_fraction(self) -> float:
+        # the part of a slot which is dropped by reporting the current position as whole slots
+        now_ns = self.clock.monotonic_ns()
+        if now_ns >= self.end_time_ns:
+            return 0
+        _, fraction = self.speed_profile.num_slots_after(self.start_pos, self.direction, self.duty_plan.progress_ns(now_ns - self.run_start_time_ns))
+        return fraction
+
+    def get_duty(self) -> float:
+        if self.num_slots == 0:
+            return 0
+        return self.duty_plan.duty_at(self.clock.monotonic_ns() - self.run_start_time_ns)
+
+    def next_deadline_ns(self) -> int:
+        # the next duty change of the motion profile or the stop deadline
+        return self.run_start_time_ns + self.duty_plan.next_change_ns(self.clock.monotonic_ns() - self.run_start_time_ns)
 
     def process(self):
         if self.is_target_reached():
             return Idling(self.motor, self.get_target_pos(), self.sec_per_slot, self.awning)
         else:
+            self.motor.set_speed(self.get_duty())
             self.awning.on_updated()
             return self
 
-    def drive_to(self, new_position: int):
+    def get_direction(self) -> int:
+        if self.is_moving_forward():
+            return 1
+        elif self.is_moving_backward():
+            return -1
+        else:
+            return 0
+
+    def get_direction_to(self, new_position: int) -> int:
+        return self.__get_direction_to(self.get_current_pos(), self.__bound(new_position))
+
+    def __get_direction_to(self, current_pos: int, new_position: int) -> int:
+        if (new_position - current_pos) > self.slot_tolerance:
+            return 1
+        elif (current_pos - new_position) > self.slot_tolerance:
+            return -1
+        else:
+            return 0
+
+    def __bound(self, new_position: int) -> int:
         if new_position > 100:
             new_position = 100
         elif new_position < 0:
             new_position = 0
-        return self.__create_movement(int(new_position))
+        return int(new_position)
+
+    def drive_to(self, new_position: int):
+        return self.__create_movement(self.__bound(new_position))
 
     def __create_movement(self, new_position: int):
         current_pos = self.get_current_pos()
-        if (new_position - current_pos) > self.SLOT_TOLERANCE:
-            return Forward(self.motor, current_pos, new_position, self.sec_per_slot, self.awning)
-        elif (current_pos - new_position) > self.SLOT_TOLERANCE:
-            return Backward(self.motor, current_pos, new_position, self.sec_per_slot, self.awning)
+        direction = self.__get_direction_to(current_pos, new_position)
+        # a motor running in the same direction is not ramped up again
+        running_duty = self.get_duty() if direction == self.get_direction() else 0
+        if direction > 0:
+            return Forward(self.motor, current_pos, new_position, self.sec_per_slot, self.awning, running_duty)
+        elif direction < 0:
+            return Backward(self.motor, current_pos, new_position, self.sec_per_slot, self.awning, running_duty)
         else:
             return Idling(self.motor, current_pos, self.sec_per_slot, self.awning)
 
 
 class Idling(Movement):
+    __slots__ = ()
 
     def __init__(self, motor: Motor, start_pos: int, sec_per_slot: float, awning):
         Movement.__init__(self, motor, start_pos, 0, sec_per_slot, True, awning)
         self.motor.stop()
         self.awning.on_updated()
 
-    def get_pause_sec(self):
-        pause_sec = int(self.SLOT_TOLERANCE * self.sec_per_slot * 1.4)
-        if pause_sec < 3:
-            pause_sec = 3
-        return pause_sec
-
     def process(self):
         return self   # do nothing
 
 
 class Forward(Movement):
+    __slots__ = ()
 
-    def __init__(self, motor: Motor, start_pos: int, new_position: int, sec_per_slot: float, awning):
-        Movement.__init__(self, motor, start_pos, new_position - start_pos, sec_per_slot, True, awning)
+    def __init__(self, motor: Motor, start_pos: int, new_position: int, sec_per_slot: float, awning, running_duty: float = 0):
+        Movement.__init__(self, motor, start_pos, new_position - start_pos, sec_per_slot, True, awning, running_duty)
+        self.motor.set_speed(self.duty_plan.duty_at(0))
         self.motor.forward()
         self.awning.on_updated()
 
@@ -176,9 +366,11 @@ class Forward(Movement):
 
 
 class Backward(Movement):
+    __slots__ = ()
 
-    def __init__(self, motor: Motor, start_pos: int, new_position: int, sec_per_slot: float, awning):
-        Movement.__init__(self, motor, start_pos, start_pos - new_position, sec_per_slot, False, awning)
+    def __init__(self, motor: Motor, start_pos: int, new_position: int, sec_per_slot: float, awning, running_duty: float = 0):
+        Movement.__init__(self, motor, start_pos, start_pos - new_position, sec_per_slot, False, awning, running_duty)
+        self.motor.set_speed(self.duty_plan.duty_at(0))
         self.motor.backward()
         self.awning.on_updated()
 
@@ -187,64 +379,367 @@ class Backward(Movement):
 
 
 
+class ScheduledTask:
+
+    def __init__(self, deadline_ns: int, callback: Callable[[], None], submit_time_ns: int):
+        self.deadline_ns = deadline_ns
+        self.callback = callback
+        self.submit_time_ns = submit_time_ns
+        self.is_cancelled = False
+
+    def cancel(self):
+        self.is_cancelled = True
+
+
+class MotionScheduler:
+    __default = None
+    __batches = local()
+
+    def __init__(self, name: str = "motion_scheduler", clock: Clock = SYSTEM_CLOCK, metrics: Metrics = None):
+        self.clock = clock
+        self.__tasks = []
+        self.__sequence = count()
+        self.__condition = Condition()
+        metrics = Metrics.default() if metrics is None else metrics
+        labels = {"scheduler": name}
+        self.__queue_wait_sec = metrics.histogram("awning_command_queue_wait_seconds", "time a command waits for the motion scheduler", labels)
+        self.__wake_jitter_sec = metrics.histogram("awning_scheduler_wake_jitter_seconds", "delay of timed motion tasks behind their deadline", labels)
+        self.__task_sec = metrics.histogram("awning_scheduler_task_seconds", "processing time of a motion task", labels)
+        # a scheduler with a virtual clock has no thread. It is driven by run_until
+        if not isinstance(clock, VirtualClock):
+            Thread(name=name, target=self.__run, daemon=True).start()
+
+    @staticmethod
+    def default():
+        if MotionScheduler.__default is None:
+            MotionScheduler.__default = MotionScheduler()
+        return MotionScheduler.__default
+
+    def schedule(self, deadline_ns: int, callback: Callable[[], None]) -> ScheduledTask:
+        task = ScheduledTask(deadline_ns, callback, self.clock.monotonic_ns())
+        with self.__condition:
+            heappush(self.__tasks, (deadline_ns, next(self.__sequence), task))
+            self.__condition.notify()
+        return task
+
+    def schedule_in(self, delay_sec: float, callback: Callable[[], None]) -> ScheduledTask:
+        return self.schedule(self.clock.monotonic_ns() + int(delay_sec * 1_000_000_000), callback)
+
+    def execute_priority(self, callback: Callable[[], None]):
+        # e.g. the emergency retract. Executed ahead of the queued commands and timers, even within a batch
+        self.schedule(-1, callback)
+
+    def execute(self, callback: Callable[[], None]):
+        # commands are due immediately and are executed in submit order, ahead of pending timers
+        batch = getattr(MotionScheduler.__batches, "callbacks", None)
+        if batch is None:
+            self.schedule(0, callback)
+        else:
+            batch.setdefault(self, []).append(callback)
+
+    @staticmethod
+    @contextmanager
+    def batch():
+        # commands executed within the batch context are processed within the same scheduler tick
+        if getattr(MotionScheduler.__batches, "callbacks", None) is not None:
+            yield
+            return
+        batch = dict()
+        MotionScheduler.__batches.callbacks = batch
+        try:
+            yield
+        finally:
+            MotionScheduler.__batches.callbacks = None
+            for scheduler, callbacks in batch.items():
+                scheduler.schedule(0, lambda callbacks=callbacks: MotionScheduler.__execute_all(callbacks))
+
+    @staticmethod
+    def __execute_all(callbacks: List[Callable[[], None]]):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning("error occurred on processing scheduled task " + str(e))
+
+    def __next_task(self) -> ScheduledTask:
+        with self.__condition:
+            while True:
+                if len(self.__tasks) > 0:
+                    timeout_ns = self.__tasks[0][0] - self.clock.monotonic_ns()
+                    if timeout_ns <= 0:
+                        return heappop(self.__tasks)[2]
+                    self.__condition.wait(timeout_ns / 1_000_000_000)
+                else:
+                    self.__condition.wait()
+
+    def __run(self):
+        while True:
+            self.__process(self.__next_task())
+
+    def __process(self, task: ScheduledTask):
+        if not task.is_cancelled:
+            now_ns = self.clock.monotonic_ns()
+            if task.deadline_ns <= 0:
+                self.__queue_wait_sec.observe((now_ns - task.submit_time_ns) / 1_000_000_000)
+            else:
+                self.__wake_jitter_sec.observe(max(0, now_ns - task.deadline_ns) / 1_000_000_000)
+            start_ns = time.perf_counter_ns()
+            try:
+                task.callback()
+            except Exception as e:
+                logging.warning("error occurred on processing scheduled task " + str(e))
+            self.__task_sec.observe((time.perf_counter_ns() - start_ns) / 1_000_000_000)
+
+    def run_until(self, deadline_ns: int):
+        # processes the due tasks of a virtual clock scheduler on the caller thread and advances the virtual time to each task deadline
+        while True:
+            with self.__condition:
+                if len(self.__tasks) == 0 or self.__tasks[0][0] > deadline_ns:
+                    break
+                task_deadline_ns, _, task = heappop(self.__tasks)
+            self.clock.advance_to(task_deadline_ns)
+            self.__process(task)
+        self.clock.advance_to(deadline_ns)
+
+
+@dataclass
+class Drift:
+    SLOT_ERROR = 0.02
+    REVERSAL_ERROR = 0.5
+
+    slots_driven: int = 0
+    reversals: int = 0
+    lost_slots: float = 0
+
+    def get_uncertainty_slots(self) -> float:
+        return (self.slots_driven * self.SLOT_ERROR) + (self.reversals * self.REVERSAL_ERROR) + self.lost_slots
+
+
+@dataclass
+class CommandStatistics:
+    received: int = 0
+    merged: int = 0
+    applied: int = 0
+    reversals_deferred: int = 0
+
+
 class PiAwning(Awning):
-    PERIODIC_CALIBRATE_ON_HOUR = 3
-    PERIODIC_CALIBRATE_ON_MINUTE = 10
 
-    def __init__(self, motor: Motor):
+    def __init__(self, motor: Motor, scheduler: MotionScheduler = None, hub: NotificationHub = None, settle_sec: float = 0.3, min_reversal_interval_sec: float = 2,
+                 journal: PositionJournal = None, calibration_threshold_slots: float = 5, metrics: Metrics = None,
+                 tracer: Tracer = None):
         self.motor = motor
-        super().__init__(self.motor.name)
+        super().__init__(self.motor.name, hub)
+        self.__trace = (Tracer.default() if tracer is None else tracer).recorder(self.name)
+        self.__register_metrics(Metrics.default() if metrics is None else metrics)
         self.sec_per_slot = motor.sec_per_step
-        self.__lock = Lock()
-        self.movement = Idling(self.motor, 0, self.sec_per_slot, self)
-        self.set_position(0)
-        Thread(name=self.name + "_move", target=self.__process_move, daemon=False).start()
-        Thread(target=self.__periodic_calibrate, daemon=True).start()
+        # all movement changes are applied by the scheduler thread, which is the single owner of the movement
+        self.__scheduler = MotionScheduler.default() if scheduler is None else scheduler
+        self.clock = self.__scheduler.clock
+        self.__task = None
+        # commands received within the settle window are merged. Only the latest target will be applied
+        self.settle_sec = settle_sec
+        self.min_reversal_interval_sec = min_reversal_interval_sec
+        self.command_statistics = CommandStatistics()
+        self.__pending_target = None
+        self.__pending_futures = []
+        self.__completion_futures = []
+        self.__flush_task = None
+        self.__settled_time_ns = 0
+        self.__last_direction = 0
+        self.__last_direction_change_time_ns = 0
+        self.__journal = journal
+        # set by the emergency retract. Targets other than 0 are rejected until the lockout is cleared
+        self.__is_locked_out = False
+        # calibration is required, if the accumulated position uncertainty exceeds the threshold
+        self.calibration_threshold_slots = calibration_threshold_slots
+        self.calibration_time_saved_sec = 0
+        self.drift = Drift()
+        initial_position, self.requires_calibration = self.__restore_position()
+        self.movement = Idling(self.motor, initial_position, self.sec_per_slot, self)
+        self.__set_target(initial_position)
+
+    def __register_metrics(self, metrics: Metrics):
+        # the metrics are created once. The motion path updates them in place
+        self.__motor_on_sec = {direction: metrics.counter("awning_motor_on_seconds_total", "motor running time", {"lane": self.name, "direction": label})
+                               for direction, label in [(1, "forward"), (-1, "backward")]}
+        self.__moves = {direction: metrics.counter("awning_moves_total", "started movements", {"lane": self.name, "direction": label})
+                        for direction, label in [(1, "forward"), (-1, "backward")]}
+        self.__reversals = metrics.counter("awning_reversals_total", "motor direction reversals", {"lane": self.name})
+        self.__calibration_sec = metrics.histogram("awning_calibration_duration_seconds", "duration of calibration drives", {"lane": self.name}, Histogram.DURATION_BOUNDS)
+        metrics.gauge("awning_position", "current position (0 = retracted, 100 = extended)", lambda: self.get_current_position(), {"lane": self.name})
+        metrics.gauge("awning_target_position", "target position", lambda: self.get_position(), {"lane": self.name})
+        metrics.gauge("awning_position_uncertainty_slots", "accumulated position uncertainty since the last calibration", lambda: self.drift.get_uncertainty_slots(), {"lane": self.name})
+
+    def __restore_position(self):
+        entry = None if self.__journal is None else self.__journal.get(self.name)
+        if entry is None:
+            return 0, True
+        self.drift = Drift(entry.slots_driven, entry.reversals, entry.lost_slots)
+        if entry.is_moving:
+            logging.info(self.name + " has been stopped while moving from " + str(entry.position) + " to " + str(entry.target) + ". Calibration required")
+            return entry.position, True
+        elif not entry.is_calibrated:
+            logging.info(self.name + " has not been calibrated since last unknown position. Calibration required")
+            return entry.position, True
+        else:
+            logging.info(self.name + " restored position " + str(entry.position))
+            return entry.position, False
 
     def terminate(self):
         self.motor.terminate()
 
+    def replace_motor(self, create_motor: Callable[[], Motor]) -> Future:
+        # e.g. on changed pins or step duration. The new motor continues at the current position and drives a pending target
+        return self.__submit(lambda: self.__replace_motor(create_motor))
+
+    def __replace_motor(self, create_motor: Callable[[], Motor]) -> Motor:
+        current_pos = self.movement.get_current_pos()
+        target_pos = self.movement.get_target_pos()
+        # raises e.g. on an invalid pin. The old motor is kept then
+        new_motor = create_motor()
+        old_motor = self.motor
+        self.motor = new_motor
+        self.sec_per_slot = new_motor.sec_per_step
+        old_motor.stop()
+        old_motor.terminate(kept_pins=new_motor.pins)
+        self.__replace_movement(Idling(new_motor, current_pos, self.sec_per_slot, self))
+        if target_pos != current_pos:
+            self.__apply_target(target_pos)
+        return self.motor
+
     def on_updated(self):
         self._notify_listeners()
 
-    def __periodic_calibrate(self):
-        time.sleep(60)
-        self.calibrate()
-        already_scheduled = False
-        while True:
-            try:
-                now = datetime.now()
-                if self.PERIODIC_CALIBRATE_ON_HOUR <= now.hour < (self.PERIODIC_CALIBRATE_ON_HOUR + 1) and now.minute >= self.PERIODIC_CALIBRATE_ON_MINUTE:
-                    if not already_scheduled:
-                        self.calibrate()
-                    already_scheduled = True
-                else:
-                    already_scheduled = False
-            except Exception as e:
-                logging.warning("error occurred on calibrating " + str(e))
-            time.sleep(10 * 60)
+    def needs_calibration(self) -> bool:
+        return self.requires_calibration or self.drift.get_uncertainty_slots() >= self.calibration_threshold_slots
+
+    def calibrate(self) -> float:
+        return self.calibrate_async().result(timeout=5 * 60)
 
-    def calibrate(self):
+    def calibrate_async(self, start_pos: int = None) -> Future:
+        # the calibration steps are chained on the scheduler thread. The returned future resolves with the saved sec
         saved_target_pos = self.get_position()
-        logging.info("calibrating")
-        self.movement = Idling(self.motor, 100, self.sec_per_slot, self) # set position to 100%
-        self.set_position(0)   # and backward to position 0. This ensures that the awning is calibrated with position 0
-        # wait until completed
-        for i in range (0, 60):
-            if self.is_target_reached():
-                break
+        if start_pos is not None:
+            start_pos = min(100, max(start_pos, 0))   # e.g. the assumed position of a replayed calibration
+        elif self.requires_calibration:
+            start_pos = 100
+        else:
+            # the real position deviates at most by the accumulated uncertainty. Driving back from there is sufficient
+            start_pos = self.get_current_position() + math.ceil(self.drift.get_uncertainty_slots())
+            start_pos = min(100, max(start_pos, self.motor.motion_profile.slot_tolerance + 1))
+        saved_sec = (100 - start_pos) * self.sec_per_slot
+        logging.info(self.name + " calibrating from assumed position " + str(start_pos))
+        self.__trace.record(TraceEvent.CALIBRATE, start_pos)
+        start_time = self.clock.monotonic()
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def on_calibrated(move: Future):
+            try:
+                if move.result() != MoveOutcome.REACHED or self.movement.get_current_pos() != 0:
+                    logging.info(self.name + " calibration interrupted")
+                    future.set_result(0)
+                    return
+                self.__on_calibrated()
+                self.__calibration_sec.observe(self.clock.monotonic() - start_time)
+                self.calibration_time_saved_sec += saved_sec
+                logging.info(self.name + " calibrated within " + str(round(self.clock.monotonic() - start_time, 1)) + " sec (saved " + str(round(saved_sec, 1)) + " sec compared to full calibration)")
+                if self.get_current_position() != saved_target_pos:
+                    logging.info("move to previous target position " + str(saved_target_pos))
+                    self.__set_target(saved_target_pos)
+                future.set_result(saved_sec)
+            except Exception as e:
+                future.set_exception(e)
+
+        move = Future()
+        move.add_done_callback(lambda move: self.__scheduler.execute(lambda: on_calibrated(move)))
+        self.__submit(lambda: self.__start_calibration(start_pos, move))
+        return future
+
+    def __start_calibration(self, start_pos: int, move: Future):
+        # the calibration target bypasses the command merging. A later user target supersedes the calibration
+        self.__replace_movement(Idling(self.motor, start_pos, self.sec_per_slot, self))
+        self.__replace_movement(self.movement.drive_to(0))   # and backward to position 0. This ensures that the awning is calibrated with position 0
+        move.set_running_or_notify_cancel()
+        if self.movement.is_target_reached():
+            move.set_result(MoveOutcome.REACHED)
+        else:
+            self.__completion_futures.append(move)
+
+    def __on_calibrated(self):
+        self.requires_calibration = False
+        self.drift = Drift()
+        self.__record(self.movement)
+
+    def stop(self) -> Future:
+        # stop is applied immediately and supersedes pending targets
+        self.__trace.record(TraceEvent.STOP)
+        return self.__submit(self.__stop)
+
+    def __stop(self) -> int:
+        if self.__is_locked_out:
+            # the emergency retract keeps running toward position 0
+            return self.movement.get_target_pos()
+        return self.__apply_target(self.movement.get_current_pos())
+
+    def emergency_retract(self) -> Future:
+        # bypasses the command queue and the command damping. The motor is driven backward by the calling thread at once
+        self.__is_locked_out = True
+        self.__trace.record(TraceEvent.EMERGENCY, 1)
+        movement = self.movement
+        if not (movement.is_moving_backward() and movement.get_target_pos() == 0):
+            # includes a lane which is extending within its first slot
+            if movement.get_current_pos() > 0:
+                self.motor.set_speed(1)
+                self.motor.backward()
             else:
-                time.sleep(5)
-        if self.get_current_position() != saved_target_pos:
-            logging.info("move to previous target position " + str(saved_target_pos))
-            self.set_position(saved_target_pos)
-
-    def stop(self):
-        self.set_position(self.get_current_position())
+                self.motor.stop()
+        future = Future()
+        self.__scheduler.execute_priority(lambda: self.__run_command(self.__retract, future))
+        return future
+
+    def __retract(self) -> int:
+        # aligns the movement with the backward running motor. Pending targets are rejected
+        if self.__flush_task is not None:
+            self.__flush_task.cancel()
+            self.__flush_task = None
+        futures = self.__pending_futures
+        self.__pending_target = None
+        self.__pending_futures = []
+        for future, _, _ in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ValueError(self.name + " is locked by the emergency retract"))
+        movement = self.movement
+        current_pos = movement.get_current_pos()
+        if not (movement.is_moving_backward() and movement.get_target_pos() == 0):
+            if current_pos > 0:
+                self.__replace_movement(Backward(self.motor, current_pos, 0, self.sec_per_slot, self, running_duty=1))
+            elif movement.get_direction() != 0:
+                self.__replace_movement(Idling(self.motor, 0, self.sec_per_slot, self))
+        return 0
+
+    def clear_lockout(self):
+        if self.__is_locked_out:
+            self.__is_locked_out = False
+            self.__trace.record(TraceEvent.EMERGENCY, 0)
+            logging.info(self.name + " emergency lockout cleared")
+
+    def is_locked_out(self) -> bool:
+        return self.__is_locked_out
 
     def get_current_position(self) -> int:
         return self.movement.get_current_pos()
 
+    def get_motion_plan(self) -> MotionPlan:
+        return self.movement.motion_plan
+
+    def get_state(self) -> AwningState:
+        movement = self.movement
+        current_position = movement.get_current_pos()
+        target_position = movement.get_target_pos()
+        return AwningState(target_position, current_position, current_position == target_position, movement.is_moving_forward(), movement.is_moving_backward())
+
     def is_target_reached(self) -> bool:
         return self.get_current_position() == self.get_position()
 
@@ -257,66 +752,345 @@ class PiAwning(Awning):
     def get_position(self) -> int:
         return self.movement.get_target_pos()
 
-    def set_position(self, new_position: int):
-        with self.__lock:
-            logging.info(self.name + " set position: " + str(new_position))
-            self.movement = self.movement.drive_to(new_position)
+    def eta_seconds(self) -> float:
+        return self.movement.eta_seconds()
 
-    def __process_move(self):
-        while True:
-            with self.__lock:
-                try:
-                    self.movement = self.movement.process()
-                except:
-                    self.movement = Idling(self.motor, 0, self.sec_per_slot, self)
-                    logging.warning('move operation failed ' + str(sys.exc_info()))
-                finally:
-                    pause_sec = self.movement.get_pause_sec()
-            time.sleep(pause_sec)
+    def set_position(self, new_position: int, until_reached: bool = False) -> Future:
+        logging.info(self.name + " set position: " + str(new_position))
+        self.__trace.record(TraceEvent.SET_POSITION, int(new_position), 1 if until_reached else 0)
+        return self.__set_target(new_position, until_reached)
+
+    def __set_target(self, new_position: int, until_reached: bool = False) -> Future:
+        # internal targets, e.g. of the calibration, are not traced as commands
+        future = Future()
+        self.__scheduler.execute(lambda: self.__on_target_received(new_position, future, until_reached))
+        return future
+
+    def __on_target_received(self, new_position: int, future: Future, until_reached: bool):
+        self.command_statistics.received += 1
+        if self.__is_locked_out and new_position > 0:
+            future.set_exception(ValueError(self.name + " is locked by the emergency retract"))
+            return
+        if self.__pending_target is not None:
+            self.command_statistics.merged += 1
+            self.__pending_futures = self.__supersede_pending(new_position)
+        self.__pending_target = new_position
+        self.__pending_futures.append((future, until_reached, new_position))
+        if self.__flush_task is None:
+            self.__flush_pending_target()
+
+    def __supersede_pending(self, new_position: int) -> List[Tuple[Future, bool, int]]:
+        # waiting for a merged target which differs from the new one is pointless. Returns the remaining pending futures
+        remaining = []
+        for future, until_reached, position in self.__pending_futures:
+            if until_reached and position != new_position:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(MoveOutcome.SUPERSEDED)
+            else:
+                remaining.append((future, until_reached, position))
+        return remaining
+
+    def __flush_pending_target(self):
+        self.__flush_task = None
+        if self.__pending_target is None:
+            return
+        now_ns = self.clock.monotonic_ns()
+        due_ns = self.__settled_time_ns
+        direction = self.movement.get_direction_to(self.__pending_target)
+        if direction != 0 and direction == -self.__last_direction:
+            # do not reverse the motor more often than the min reversal interval
+            reversal_allowed_ns = self.__last_direction_change_time_ns + int(self.min_reversal_interval_sec * 1_000_000_000)
+            if reversal_allowed_ns > now_ns:
+                self.command_statistics.reversals_deferred += 1
+                due_ns = max(due_ns, reversal_allowed_ns)
+        if due_ns > now_ns:
+            self.__flush_task = self.__scheduler.schedule(due_ns, self.__flush_pending_target)
+        else:
+            self.__apply_target(self.__pending_target)
+
+    def __apply_target(self, new_position: int) -> int:
+        if self.__flush_task is not None:
+            self.__flush_task.cancel()
+            self.__flush_task = None
+        futures = self.__supersede_pending(new_position)
+        self.__pending_target = None
+        self.__pending_futures = []
+        try:
+            self.__replace_movement(self.movement.drive_to(new_position))
+            target_position = self.movement.get_target_pos()
+            self.command_statistics.applied += 1
+            self.__settled_time_ns = self.clock.monotonic_ns() + int(self.settle_sec * 1_000_000_000)
+            for future, until_reached, _ in futures:
+                if future.set_running_or_notify_cancel():
+                    if not until_reached:
+                        future.set_result(target_position)
+                    elif self.movement.is_target_reached():
+                        future.set_result(MoveOutcome.REACHED)
+                    else:
+                        self.__completion_futures.append(future)
+            return target_position
+        except Exception as e:
+            [future.set_exception(e) for future, _, _ in futures if future.set_running_or_notify_cancel()]
+            raise e
+
+    def __submit(self, command: Callable[[], Any]) -> Future:
+        future = Future()
+        self.__scheduler.execute(lambda: self.__run_command(command, future))
+        return future
+
+    def __run_command(self, command: Callable[[], Any], future: Future):
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(command())
+            except Exception as e:
+                future.set_exception(e)
+
+    def __replace_movement(self, movement: Movement):
+        self.__complete_moves(MoveOutcome.SUPERSEDED)
+        self.__set_movement(movement)
+
+    def __complete_moves(self, outcome: str = None, error: Exception = None):
+        futures = self.__completion_futures
+        self.__completion_futures = []
+        for future in futures:
+            if error is None:
+                future.set_result(outcome)
+            else:
+                future.set_exception(error)
+
+    def __record(self, movement: Movement):
+        if self.__journal is not None:
+            self.__journal.record(self.name, movement.start_pos, movement.get_target_pos(), movement.get_direction() != 0, not self.requires_calibration,
+                                  self.drift.slots_driven, self.drift.reversals, self.drift.lost_slots)
+
+    def __track_drift(self, old_movement: Movement, new_movement: Movement):
+        if old_movement.get_direction() != 0:
+            self.drift.slots_driven += abs(old_movement.get_current_pos() - old_movement.start_pos)
+            self.drift.lost_slots += old_movement.get_lost_slot_fraction()
+        direction = new_movement.get_direction()
+        # a reversal is counted only if the motor is still running in the opposite direction, not after a rest
+        if direction != 0 and old_movement.get_direction() == -direction:
+            self.drift.reversals += 1
+            self.__reversals.inc()
+
+    def __set_movement(self, movement: Movement):
+        # has to be called by the scheduler thread only
+        if movement is not self.movement:
+            self.__track_drift(self.movement, movement)
+            self.__record(movement)
+            self.__trace.record(TraceEvent.MOVEMENT, movement.start_pos, movement.get_target_pos())
+            old_direction = self.movement.get_direction()
+            if old_direction != 0:
+                self.__motor_on_sec[old_direction].inc((self.clock.monotonic_ns() - self.movement.start_time_ns) / 1_000_000_000)
+            if movement.get_direction() != 0:
+                self.__moves[movement.get_direction()].inc()
+        self.movement = movement
+        direction = movement.get_direction()
+        if direction != 0:
+            if direction != self.__last_direction:
+                self.__last_direction_change_time_ns = self.clock.monotonic_ns()
+            self.__last_direction = direction
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        if movement.is_moving_forward() or movement.is_moving_backward():
+            # wake up at the exact duty change or stop deadline. Progress is not notified, clients interpolate the motion plan
+            self.__task = self.__scheduler.schedule(movement.next_deadline_ns(), lambda: self.__process_move(movement))
+
+    def __process_move(self, movement: Movement):
+        if self.movement is movement:
+            try:
+                self.__set_movement(self.movement.process())
+                if self.movement is not movement:
+                    self.__complete_moves(MoveOutcome.REACHED)
+            except Exception as e:
+                self.__complete_moves(error=e)
+                self.__set_movement(Idling(self.motor, 0, self.sec_per_slot, self))
+                logging.warning('move operation failed ' + str(sys.exc_info()))
+
+
+
+class Calibrator:
+    CALIBRATE_ON_HOUR = 3
+    CALIBRATE_ON_MINUTE = 10
+
+    def __init__(self, awnings: List[PiAwning], stagger_sec: float = 2):
+        self.awnings = awnings
+        self.stagger_sec = stagger_sec
+        self.calibration_time_saved_sec = 0
+
+    def start(self):
+        Thread(name="calibrator", target=self.__periodic_calibrate, daemon=True).start()
+
+    def set_awnings(self, awnings: List[PiAwning]):
+        self.awnings = awnings
 
+    def calibrate(self, force: bool = False) -> float:
+        all_awnings = self.awnings
+        awnings = [awning for awning in all_awnings if force or awning.needs_calibration()]
+        saved_secs = [0] * len(awnings)
+
+        def calibrate_awning(index: int):
+            # motors are started staggered to limit the inrush current
+            time.sleep(index * self.stagger_sec)
+            try:
+                saved_secs[index] = awnings[index].calibrate()
+            except Exception as e:
+                logging.warning("error occurred on calibrating " + awnings[index].name + " " + str(e))
+
+        threads = [Thread(target=calibrate_awning, args=(index,), daemon=True) for index in range(len(awnings))]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        saved_sec = sum(saved_secs) + sum([100 * awning.sec_per_slot for awning in all_awnings if awning not in awnings])
+        self.calibration_time_saved_sec += saved_sec
+        logging.info(str(len(awnings)) + " of " + str(len(all_awnings)) + " lanes calibrated. Saved " + str(round(saved_sec, 1)) +
+                     " motor sec compared to full calibration (total " + str(round(self.calibration_time_saved_sec, 1)) + " sec)")
+        return saved_sec
+
+    def __periodic_calibrate(self):
+        time.sleep(60)
+        self.calibrate()
+        already_scheduled = False
+        while True:
+            try:
+                now = datetime.now()
+                if self.CALIBRATE_ON_HOUR <= now.hour < (self.CALIBRATE_ON_HOUR + 1) and now.minute >= self.CALIBRATE_ON_MINUTE:
+                    if not already_scheduled:
+                        self.calibrate()
+                    already_scheduled = True
+                else:
+                    already_scheduled = False
+            except Exception as e:
+                logging.warning("error occurred on calibrating " + str(e))
+            time.sleep(10 * 60)
 
 
 class Awnings(Awning):
+    AGGREGATION_MEAN = "mean"
+    AGGREGATION_MIN = "min"
+    AGGREGATION_MAX = "max"
+
+    def __init__(self, name: str, awnings: List[Awning], hub: NotificationHub = None, aggregation: str = AGGREGATION_MEAN, weights: Dict[str, float] = None):
+        super().__init__(name, hub)
+        if aggregation not in (self.AGGREGATION_MEAN, self.AGGREGATION_MIN, self.AGGREGATION_MAX):
+            raise ValueError("unsupported aggregation " + aggregation)
+        self.__aggregation = aggregation
+        self.__weights_by_name = dict() if weights is None else weights
+        self.__lock = Lock()
+        self.__awnings = []
+        self.__weights = []
+        self.__states = []
+        self.__child_listeners = dict()
+        self.set_awnings(awnings)
+
+    def set_awnings(self, awnings: List[Awning]):
+        # the members can be changed at runtime, e.g. on reloading the configuration
+        with self.__lock:
+            for awning in [awning for awning in self.__child_listeners.keys() if awning not in awnings]:
+                awning.remove_listener(self.__child_listeners.pop(awning))
+            for awning in [awning for awning in awnings if awning not in self.__child_listeners]:
+                self.__child_listeners[awning] = lambda awning=awning: self.__on_child_updated(awning)
+                awning.add_listener(self.__child_listeners[awning])
+            self.__awnings = list(awnings)
+            self.__weights = [self.__weights_by_name.get(awning.name, 1.0) for awning in awnings]
+            self.__states = [awning.get_state() for awning in awnings]
+            self.__state = self.__aggregate(self.__states)
+        self._notify_listeners()
 
-    def __init__(self, name: str, awnings: List[Awning]):
-        self.__awnings = awnings
-        [awning.add_listener(self._notify_listeners) for awning in awnings]
-        super().__init__(name)
+    def get_awnings(self) -> List[Awning]:
+        return self.__awnings
 
-    def is_target_reached(self) -> bool:
-        for awning in self.__awnings:
-            if not awning.is_target_reached():
-                return False
-        return True
+    def __on_child_updated(self, awning: Awning):
+        state = awning.get_state()
+        with self.__lock:
+            if awning in self.__awnings:
+                self.__states[self.__awnings.index(awning)] = state
+                self.__state = self.__aggregate(self.__states)
+        self._notify_listeners()
+
+    def __refresh(self):
+        with self.__lock:
+            self.__states = [awning.get_state() for awning in self.__awnings]
+            self.__state = self.__aggregate(self.__states)
 
+    def __aggregate_position(self, positions: List[int]) -> int:
+        if len(positions) == 0:
+            return 0
+        elif self.__aggregation == self.AGGREGATION_MIN:
+            return min(positions)
+        elif self.__aggregation == self.AGGREGATION_MAX:
+            return max(positions)
+        else:
+            total_weight = sum(self.__weights)
+            if total_weight <= 0:
+                return 0
+            return int(sum(position * weight for position, weight in zip(positions, self.__weights)) / total_weight)
 
-    def is_moving_backward(self) -> bool:
-        for anwing in self.__awnings:
-            if anwing.is_moving_backward():
-                return True
-        return False
+    def __aggregate(self, states: List[AwningState]) -> AwningState:
+        return AwningState(self.__aggregate_position([state.position for state in states]),
+                           self.__aggregate_position([state.current_position for state in states]),
+                           all(state.is_target_reached for state in states),
+                           any(state.is_moving_forward for state in states),
+                           any(state.is_moving_backward for state in states))
 
+    def get_state(self) -> AwningState:
+        return self.__state
+
+    def is_target_reached(self) -> bool:
+        return self.__state.is_target_reached
+
+    def is_moving_backward(self) -> bool:
+        return self.__state.is_moving_backward
 
     def is_moving_forward(self) -> bool:
-        for anwing in self.__awnings:
-            if anwing.is_moving_forward():
-                return True
-        return False
+        return self.__state.is_moving_forward
 
-    def stop(self):
-        for anwing in self.__awnings:
-            anwing.stop()
+    def stop(self) -> Future:
+        return self.__refresh_on_completion([anwing.stop() for anwing in self.__awnings])
 
     def get_position(self) -> int:
-        positions = [awning.get_position() for awning in self.__awnings]
-        total = sum(positions)
-        if total == 0:
-            return 0
-        else:
-            return int(total/len(positions))
+        return self.__state.position
 
-    def set_position(self, new_position: int):
+    def eta_seconds(self) -> float:
+        return max([awning.eta_seconds() for awning in self.__awnings], default=0)
+
+    def set_position(self, new_position: int, until_reached: bool = False) -> Future:
         logging.info(self.name + " set position: " + str(new_position))
-        [awning.set_position(new_position) for awning in self.__awnings]
+        with MotionScheduler.batch():
+            futures = [awning.set_position(new_position, until_reached) for awning in self.__awnings]
+        return self.__refresh_on_completion(futures, until_reached)
+
+    def __refresh_on_completion(self, futures: List[Future], until_reached: bool = False) -> Future:
+        future = Future()
+        pending = [len(futures)]
+        pending_lock = Lock()
+
+        def on_done(_):
+            with pending_lock:
+                pending[0] -= 1
+                if pending[0] > 0:
+                    return
+            try:
+                self.__refresh()
+                results = [child_future.result() for child_future in futures]
+                if not until_reached:
+                    future.set_result(self.get_position())
+                elif all(result == MoveOutcome.REACHED for result in results):
+                    future.set_result(MoveOutcome.REACHED)
+                else:
+                    future.set_result(MoveOutcome.SUPERSEDED)
+            except Exception as e:
+                future.set_exception(e)
+
+        if len(futures) == 0:
+            on_done(None)
+        else:
+            for child_future in futures:
+                child_future.add_done_callback(on_done)
+        return future
 
 
+def set_positions(positions: Dict[Awning, int], until_reached: bool = False) -> Dict[Awning, Future]:
+    # applies the positions of several awnings in one pass. The lanes are started within the same scheduler tick
+    with MotionScheduler.batch():
+        return {awning: awning.set_position(position, until_reached) for awning, position in positions.items()}
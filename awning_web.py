@@ -1,61 +1,346 @@
 import json
+import time
 import threading
 import logging
+from collections import deque
+from dataclasses import asdict
+from queue import Queue, Full, Empty
 from urllib.parse import urlparse, parse_qs
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from awning import Awning
-from typing import List, Dict, Any
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from awning import Awning, set_positions
+from emergency import EmergencyRetract
+from metrics import Metrics
+from trace_recorder import Tracer
+from typing import List, Dict, Any, Optional, Callable
+
+
+def awning_status(awning: Awning) -> Dict[str, Any]:
+    state = awning.get_state()
+    return {'target_position': state.position,
+            'current_position': state.current_position,
+            'is_target_reached': state.is_target_reached,
+            'is_moving_forward': state.is_moving_forward,
+            'is_moving_backward': state.is_moving_backward,
+            'eta_seconds': awning.eta_seconds(),
+            'motion_plan': asdict(awning.get_motion_plan())}
+
+
+class ChangeSubscription:
+
+    def __init__(self, buffer_size: int):
+        self.queue = Queue(maxsize=buffer_size)
+        self.is_dropped = False
+
+
+class ChangeStream:
+
+    def __init__(self, awnings: List[Awning], history_size: int = 256, client_buffer_size: int = 64):
+        self.client_buffer_size = client_buffer_size
+        self.__condition = threading.Condition()
+        self.__history = deque(maxlen=history_size)
+        self.__seq = 0
+        self.__last_states = dict()
+        self.__versions = dict()
+        self.__subscriptions = set()
+        self.__listeners: Dict[Awning, Callable[[], None]] = dict()
+        self.set_awnings(awnings)
+
+    def set_awnings(self, awnings: List[Awning]):
+        # removed awnings are unregistered before new ones are registered, which may reuse the name
+        with self.__condition:
+            for awning in [awning for awning in self.__listeners.keys() if awning not in awnings]:
+                awning.remove_listener(self.__listeners.pop(awning))
+                self.__last_states.pop(awning.name, None)
+                self.__versions.pop(awning.name, None)
+            for awning in awnings:
+                if awning not in self.__listeners:
+                    self.__listeners[awning] = lambda awning=awning: self.__on_changed(awning)
+                    awning.add_listener(self.__listeners[awning])
+
+    @property
+    def seq(self) -> int:
+        return self.__seq
+
+    def __on_changed(self, awning: Awning):
+        # called by the notification hub. Must never block
+        version, state = awning.get_versioned_state()
+        if state is None:
+            return
+        new_values = asdict(state)
+        new_values['motion_plan'] = asdict(awning.get_motion_plan())
+        with self.__condition:
+            if awning not in self.__listeners:
+                return   # removed in the meantime
+            old_values = self.__last_states.get(awning.name, {})
+            self.__last_states[awning.name] = new_values
+            self.__versions[awning.name] = version
+            delta = {key: value for key, value in new_values.items() if old_values.get(key, None) != value}
+            if len(delta) == 0:
+                return
+            self.__seq += 1
+            change = {'seq': self.__seq, 'name': awning.name, 'version': version, **delta}
+            self.__history.append(change)
+            self.__condition.notify_all()
+            for subscription in list(self.__subscriptions):
+                try:
+                    subscription.queue.put_nowait(change)
+                except Full:
+                    # slow consumers are dropped instead of slowing down the notification
+                    subscription.is_dropped = True
+                    self.__subscriptions.discard(subscription)
+
+    def __changes_since(self, since: Optional[int]) -> List[Dict[str, Any]]:
+        # lock has to be held by the caller
+        if since is not None and since <= self.__seq and len(self.__history) > 0 and self.__history[0]['seq'] <= since + 1:
+            return [change for change in self.__history if change['seq'] > since]
+        else:
+            # unknown, too old or future cursor (e.g. of a client of the previous server run). Start with the full state of all awnings
+            return [{'seq': self.__seq, 'name': name, 'version': self.__versions[name], **values} for name, values in self.__last_states.items()]
+
+    def subscribe(self, since: Optional[int] = None) -> ChangeSubscription:
+        subscription = ChangeSubscription(self.client_buffer_size)
+        with self.__condition:
+            for change in self.__changes_since(since)[-self.client_buffer_size:]:
+                subscription.queue.put_nowait(change)
+            self.__subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ChangeSubscription):
+        with self.__condition:
+            self.__subscriptions.discard(subscription)
+
+    def wait_for_changes(self, since: Optional[int], timeout_sec: float) -> List[Dict[str, Any]]:
+        with self.__condition:
+            if since is not None and since == self.__seq:
+                self.__condition.wait_for(lambda: self.__seq > since, timeout_sec)
+                if since == self.__seq:
+                    return []
+            return self.__changes_since(since)
 
 
 class SimpleRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    timeout = 60   # closes idle or stalled connections
+    wbufsize = 16 * 1024   # header and body are sent within a single write
+    disable_nagle_algorithm = True
 
     def log_message(self, format, *args):
         # suppress access logging
         pass
 
     def do_GET(self):
+        start_ns = time.perf_counter_ns()
         parsed_url = urlparse(self.path)
         awning_name = parsed_url.path.lstrip("/")
-        awning = next((s for s in self.server.awnings if s.name == awning_name), None)
-        if awning:
+        awning = self.server.awnings_by_name.get(awning_name, None)
+        route = awning_name if awning_name in self.server.ROUTES else ("awning" if awning else "index")
+        try:
+            # the emergency retract is accepted during the startup as well. Lanes are retracted as soon as they are set
+            if not self.server.is_ready and awning_name not in ("metrics", "_emergency"):
+                self._send_starting()
+            else:
+                self._handle_get(parsed_url, awning_name, awning)
+        finally:
+            self.server.request_duration_sec[("GET", route)].observe((time.perf_counter_ns() - start_ns) / 1_000_000_000)
+
+    def _handle_get(self, parsed_url, awning_name: str, awning: Optional[Awning]):
+        if awning_name == "metrics":
+            self._send(200, "text/plain; version=0.0.4; charset=utf-8", self.server.metrics.render().encode("utf-8"))
+        elif awning_name == "_trace":
             query_params = parse_qs(parsed_url.query)
-            if 'position' in query_params:
+            lanes = query_params.get('lane', None)
+            if query_params.get('format', ['ndjson'])[0] == 'binary':
+                self._send(200, "application/octet-stream", self.server.tracer.dump_binary(lanes))
+            else:
+                self._send(200, "application/x-ndjson", "".join(self.server.tracer.dump_ndjson(lanes)).encode("utf-8"))
+        elif awning_name == "_emergency" and self.server.emergency is not None:
+            # e.g. /_emergency?action=retract. Without action the status is returned
+            action = parse_qs(parsed_url.query).get('action', [None])[0]
+            if action == "retract":
+                self._send_json(200, self.server.emergency.retract("http"))
+            elif action == "clear":
+                self._send_json(200, self.server.emergency.clear("http"))
+            elif action is None:
+                self._send_json(200, self.server.emergency.status())
+            else:
+                self._send_json(400, {"error": "unsupported action " + action + ". Supported: retract, clear"})
+        elif awning_name == "_status":
+            self._send_json(200, {awning.name: awning_status(awning) for awning in self.server.awnings})
+        elif awning_name == "_events":
+            try:
+                since = self._since(parsed_url)
+                last_event_id = self.headers.get('Last-Event-ID', None)
+                if last_event_id is not None:
+                    # a reconnecting client continues with the Last-Event-ID
+                    since = int(last_event_id)
+            except ValueError as e:
+                self._send_json(400, {"error": "invalid cursor " + str(e)})
+                return
+            self._stream_changes(since)
+        elif awning_name == "_changes":
+            try:
+                since = self._since(parsed_url)
+                timeout_sec = min(float(parse_qs(parsed_url.query).get('timeout', ['30'])[0]), 120)
+            except ValueError as e:
+                self._send_json(400, {"error": "invalid parameter " + str(e)})
+                return
+            changes = self.server.change_stream.wait_for_changes(since, timeout_sec)
+            self._send_json(200, {'seq': self.server.change_stream.seq, 'changes': changes})
+        elif awning_name == "_positions":
+            positions = {name: values[0] for name, values in parse_qs(parsed_url.query).items()}
+            self._set_positions(positions)
+        elif awning:
+            query_params = parse_qs(parsed_url.query)
+            if 'stop' in query_params:
+                try:
+                    target_position = awning.stop().result(timeout=self.server.command_timeout_sec)
+                    self._send_json(200, {'target_position': target_position})
+                except Exception as e:
+                    self._send_json(400, {"error": str(e)})
+            elif 'position' in query_params:
                 try:
                     new_pos = int(query_params['position'][0])
-                    awning.set_position(new_pos)
-                    self._send_json(200, {'target_position': awning.get_position()})
+                    if query_params.get('wait', ['false'])[0].lower() == 'true':
+                        # blocks until the target is reached or superseded by another command
+                        outcome = awning.set_position(new_pos, until_reached=True).result(timeout=self.server.move_timeout_sec)
+                        self._send_json(200, {'target_position': awning.get_position(), 'outcome': outcome})
+                    else:
+                        target_position = awning.set_position(new_pos).result(timeout=self.server.command_timeout_sec)
+                        self._send_json(200, {'target_position': target_position, 'eta_seconds': awning.eta_seconds()})
                 except Exception as e:
                     self._send_json(400, {"error": str(e)})
             else:
-                self._send_json(200, {'position': awning.get_position()})
+                self._send_json(200, {'position': awning.get_position(), 'motion_plan': asdict(awning.get_motion_plan())})
         else:
-            html = "<h1>available awnings</h1><ul>"
-            for s in self.server.awnings :
-                html += f"<li><a href='/{s.name}'>{s.name}</a></li>"
-            html += "</ul>"
-            self._send_html(200, html)
+            self._send(200, "text/html; charset=utf-8", self.server.index_html)
 
-    def _send_html(self, status, message):
+    def do_POST(self):
+        start_ns = time.perf_counter_ns()
+        parsed_url = urlparse(self.path)
+        route = "_positions" if parsed_url.path == "/_positions" else "index"
+        try:
+            # the body is always consumed. Otherwise it would be parsed as the next request of the keep-alive connection
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            except ValueError as e:
+                self.close_connection = True
+                self._send_json(400, {"error": "invalid Content-Length " + str(e)})
+                return
+            if not self.server.is_ready:
+                self._send_starting()
+            elif route == "_positions":
+                try:
+                    self._set_positions(json.loads(body))
+                except Exception as e:
+                    self._send_json(400, {"error": str(e)})
+            else:
+                self._send_json(404, {"error": "unknown path " + parsed_url.path})
+        finally:
+            self.server.request_duration_sec[("POST", route)].observe((time.perf_counter_ns() - start_ns) / 1_000_000_000)
+
+    def _since(self, parsed_url) -> Optional[int]:
+        since = parse_qs(parsed_url.query).get('since', [None])[0]
+        return None if since is None else int(since)
+
+    def _stream_changes(self, since: Optional[int]):
+        # server-sent events
+        subscription = self.server.change_stream.subscribe(since)
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header("Content-type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.flush()
+            while not subscription.is_dropped:
+                # events are written unbuffered to the socket
+                try:
+                    change = subscription.queue.get(timeout=self.server.keep_alive_sec)
+                    self.connection.sendall(("id: " + str(change['seq']) + "\ndata: " + json.dumps(change) + "\n\n").encode("utf-8"))
+                except Empty:
+                    self.connection.sendall(b": keep-alive\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.change_stream.unsubscribe(subscription)
+
+    def _set_positions(self, positions: Dict[str, Any]):
+        try:
+            unknown = [name for name in positions.keys() if name not in self.server.awnings_by_name]
+            if len(unknown) > 0:
+                raise ValueError("unknown awning(s) " + ", ".join(unknown))
+            futures = set_positions({self.server.awnings_by_name[name]: int(position) for name, position in positions.items()})
+            self._send_json(200, {awning.name: future.result(timeout=self.server.command_timeout_sec) for awning, future in futures.items()})
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+
+    def _send(self, status, content_type: str, body: bytes):
         self.send_response(status)
-        self.send_header("Content-type", "text/html; charset=utf-8")
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(message.encode("utf-8"))
+        self.wfile.write(body)
 
-    def _send_json(self, status, data: Dict[str, Any]):
-        self.send_response(status)
+    def _send_starting(self):
+        # the port is bound before the lanes are initialized
+        body = json.dumps({"error": "starting"}).encode("utf-8")
+        self.send_response(503)
         self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", "1")
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode("utf-8"))
+        self.wfile.write(body)
+
+    def _send_html(self, status, message):
+        self._send(status, "text/html; charset=utf-8", message.encode("utf-8"))
+
+    def _send_json(self, status, data: Dict[str, Any]):
+        self._send(status, "application/json", json.dumps(data).encode("utf-8"))
+
+
+class AwningHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    ROUTES = ("metrics", "_trace", "_emergency", "_status", "_events", "_changes", "_positions")
+
+    def __init__(self, address, awnings: Optional[List[Awning]], metrics: Metrics = None, tracer: Tracer = None, emergency: EmergencyRetract = None):
+        super().__init__(address, SimpleRequestHandler)
+        self.emergency = emergency
+        self.metrics = Metrics.default() if metrics is None else metrics
+        self.tracer = Tracer.default() if tracer is None else tracer
+        self.request_duration_sec = {(method, route): self.metrics.histogram("awning_http_request_duration_seconds", "http request latency", {"method": method, "route": route})
+                                     for method, routes in [("GET", self.ROUTES + ("awning", "index")), ("POST", ("_positions", "index"))] for route in routes}
+        self.command_timeout_sec = 5
+        self.move_timeout_sec = 5 * 60
+        self.keep_alive_sec = 15
+        self.change_stream = ChangeStream([])
+        self.set_awnings([] if awnings is None else awnings)
+        # without awnings the server answers 503 until the awnings are set
+        self.is_ready = awnings is not None
+
+    def set_awnings(self, awnings: List[Awning]):
+        # the name index and the rendered index page are rebuilt only if the awning set changes
+        html = "<h1>available awnings</h1><ul>"
+        for s in awnings:
+            html += f"<li><a href='/{s.name}'>{s.name}</a></li>"
+        html += "</ul>"
+        self.change_stream.set_awnings(awnings)
+        self.awnings_by_name = {awning.name: awning for awning in awnings}
+        self.index_html = html.encode("utf-8")
+        self.awnings = awnings
+        self.is_ready = True
+
 
 class AwningWebServer:
-    def __init__(self, awnings: List[Awning],  host='0.0.0.0', port=8000):
+    def __init__(self, awnings: Optional[List[Awning]],  host='0.0.0.0', port=8000, metrics: Metrics = None, tracer: Tracer = None, emergency: EmergencyRetract = None):
         self.host = host
         self.port = port
         self.address = (self.host, self.port)
-        self.server = HTTPServer(self.address, SimpleRequestHandler)
-        self.server.awnings = awnings
+        self.server = AwningHTTPServer(self.address, awnings, metrics, tracer, emergency)
         self.server_thread = None
 
+    def set_awnings(self, awnings: List[Awning]):
+        self.server.set_awnings(awnings)
+
     def start(self):
         self.server_thread = threading.Thread(target=self.server.serve_forever)
         self.server_thread.daemon = True
@@ -66,4 +351,3 @@ class AwningWebServer:
         self.server.shutdown()
         self.server.server_close()
         logging.info("web server stopped")
-
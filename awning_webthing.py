@@ -1,115 +1,177 @@
+import time
+# the startup timing includes the imports
+import_start = time.perf_counter()
 import sys
+import socket
 import logging
-import tornado.ioloop
-from webthing import (MultipleThings, Property, Thing, Value, WebThingServer)
-from awning import Awning, PiAwning, Awnings
-from switch import Switch
-from motor_tb6612Fng import load_tb6612fng
+from threading import Thread
+from typing import List, Tuple
 from time import sleep
+from os import path
+from awning import PiAwning, Awnings, Calibrator
+from switch import Switch
+from motor_tb6612Fng import load_tb6612fng, load_gpio_backend, create_tb6612fng
+from speed_profile import load_speed_profiles
+from config_reloader import ConfigReloader
 from awning_web import AwningWebServer
+from remote_awning import load_remote_controllers
+from emergency import EmergencyRetract, load_emergency_socket
+from position_journal import PositionJournal
+
+
+class StartupTiming:
+    # the duration of each startup phase
 
+    def __init__(self, start: float):
+        self.__start = start
+        self.__last = start
+        self.phases: List[Tuple[str, float]] = []
 
-class AwningWebThing(Thing):
-
-    # regarding capabilities refer https://iot.mozilla.org/schemas
-    # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
-
-    def __init__(self, awning: Awning):
-        Thing.__init__(
-            self,
-            'urn:dev:ops:anwing-TB6612FNG',
-            'awning_' + awning.name,
-            ['MultiLevelSensor'],
-            "awning control"
-        )
-        self.awning = awning
-        self.awning.add_listener(self.on_value_changed)
-
-        self.name = Value(self.awning.name)
-        self.add_property(
-            Property(self,
-                     'name',
-                     self.name,
-                     metadata={
-                         'title': 'Name',
-                         "type": "sting",
-                         'description': 'the name',
-                         'readOnly': True
-                     }))
-
-        self.position = Value(self.awning.get_position(), self.awning.set_position)
-        self.add_property(
-            Property(self,
-                     'position',
-                     self.position,
-                     metadata={
-                         '@type': 'LevelProperty',
-                         'title': 'Awning position',
-                         "type": "number",
-                         "minimum": 0,
-                         "maximum": 100,
-                         "unit": "percent",
-                         'description': 'awning position',
-                         'readOnly': False
-                     }))
-
-        self.is_target_reached = Value(self.awning.is_target_reached())
-        self.add_property(
-            Property(self,
-                     'is_target_reached',
-                     self.is_target_reached,
-                     metadata={
-                         'title': 'is_target_reached',
-                         "type": "boolean",
-                         'description': 'true, if target position is reached',
-                         'readOnly': True
-                     }))
-
-        self.ioloop = tornado.ioloop.IOLoop.current()
-
-    def on_value_changed(self):
-        self.ioloop.add_callback(self._on_value_changed)
-
-    def _on_value_changed(self):
-        self.position.notify_of_external_update(self.awning.get_position())
-        self.is_target_reached.notify_of_external_update(self.awning.is_target_reached())
+    def phase(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.__last))
+        self.__last = now
 
+    def log(self):
+        logging.info("startup took " + str(round((self.__last - self.__start) * 1000)) + " ms (" +
+                     ", ".join([name + " " + str(round(duration_sec * 1000)) + " ms" for name, duration_sec in self.phases]) + ")")
+
+
+def bind_socket(port: int) -> socket.socket:
+    # the port is bound before the webthing server is imported. Early connections are queued by the kernel
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port))
+    sock.listen(128)
+    sock.setblocking(False)
+    return sock
 
 
 def run_server(port: int, filename: str, switch_pin_forward: int, switch_pin_backward: int):
     logging.info("switch_pin_forward " + str(switch_pin_forward))
     logging.info("switch_pin_backward " + str(switch_pin_backward))
+    start = import_start
 
     while True:
-        awnings = [PiAwning(motor) for motor in load_tb6612fng(filename)]
-        anwing_all= Awnings("all", awnings)
-        awnings = [anwing_all] + awnings
-        awning_webthings = [AwningWebThing(anwing) for anwing in awnings]
-
-        web_server = AwningWebServer(awnings, port=port+1)
-        server = WebThingServer(MultipleThings(awning_webthings, 'Awnings'), port=port, disable_host_validation=True)
+        timing = StartupTiming(start)
+        timing.phase("imports")
+        # the ports are bound first. Until the lanes are initialized, the http api answers with 503
+        emergency = EmergencyRetract([])
+        web_server = AwningWebServer(None, port=port+1, emergency=emergency)
+        web_server.start()
+        webthing_socket = bind_socket(port)
+        timing.phase("bind ports")
+
+        gpio = load_gpio_backend(filename)
+        timing.phase("gpio backend")
+        journal = PositionJournal(path.splitext(filename)[0] + ".journal")
+        speed_profiles_filename = path.splitext(filename)[0] + ".speed"
+        lanes = [PiAwning(motor, journal=journal) for motor in load_tb6612fng(filename, gpio)]
+        calibrator = Calibrator(lanes)
+        remotes = load_remote_controllers(filename)
+        remote_awnings = [awning for remote in remotes for awning in remote.get_awnings()]
+        anwing_all= Awnings("all", lanes + remote_awnings)
+        awnings = [anwing_all] + lanes + remote_awnings
+        emergency.set_awnings(lanes)
+        emergency.set_remotes(remotes)
+        emergency_socket = load_emergency_socket(filename, emergency)
+        web_server.set_awnings(awnings)
+        timing.phase("lanes")
+
+        # the webthing frontend is imported after the http api is available
+        import tornado.ioloop
+        from webthing_frontend import AwningWebThing, create_webthing_server, serve_webthings, stop_webthings
+        timing.phase("webthing import")
+        server = create_webthing_server(awnings, port, emergency)
+        awning_webthings = {thing.awning.name: thing for thing in server.things.get_things()}
+        ioloop = tornado.ioloop.IOLoop.current()
+        timing.phase("webthing server")
+
+        # the frontends receive the lanes on reloading the config
+        frontends = [web_server]
+
+        reloader = ConfigReloader(filename, lanes,
+                                  create_motor=lambda config: create_tb6612fng(config, gpio, load_speed_profiles(speed_profiles_filename)),
+                                  create_lane=lambda motor: PiAwning(motor, journal=journal))
+
+        def update_webthings(lanes: List[PiAwning]):
+            # called by the ioloop. The things are addressed by index, so the hrefs are renewed
+            awnings = [anwing_all] + lanes + remote_awnings
+            for name, thing in list(awning_webthings.items()):
+                if all(thing.awning is not anwing for anwing in awnings):
+                    thing.detach()
+                    del awning_webthings[name]
+            for anwing in lanes:
+                if anwing.name not in awning_webthings:
+                    awning_webthings[anwing.name] = AwningWebThing(anwing)
+            server.things.things = [awning_webthings[anwing.name] for anwing in awnings]
+            for idx, thing in enumerate(server.things.things):
+                thing.set_href_prefix('/' + str(idx))
+
+        def on_lanes_changed(lanes: List[PiAwning]):
+            calibrator.set_awnings(lanes)
+            emergency.set_awnings(lanes)
+            anwing_all.set_awnings(lanes + remote_awnings)
+            for frontend in list(frontends):
+                frontend.set_awnings([anwing_all] + lanes + remote_awnings)
+            ioloop.add_callback(update_webthings, lanes)
+            logging.info("lanes reloaded: " + ", ".join([lane.name for lane in lanes]))
+
+        reloader.add_listener(on_lanes_changed)
+
+        def start_mcp_server():
+            # the mcp frontend is optional. It is imported and started in the background
+            mcp_start = time.perf_counter()
+            try:
+                from mcp_server import MCPServer
+            except ImportError as e:
+                logging.warning("MCP server disabled " + str(e))
+                return
+            mcp_server = MCPServer("awning", port+2, emergency=emergency)
+            frontends.append(mcp_server)
+            mcp_server.set_awnings([anwing_all] + reloader.lanes + remote_awnings)
+            mcp_server.start()
+            logging.info("MCP server started in " + str(round((time.perf_counter() - mcp_start) * 1000)) + " ms")
+
+        def on_started():
+            timing.phase("webthing start")
+            timing.log()
 
         switch = None
         if switch_pin_forward > 0 and switch_pin_backward > 0:
-            switch = Switch(switch_pin_forward, switch_pin_backward, awnings=anwing_all)
+            switch = Switch(switch_pin_forward, switch_pin_backward, awnings=anwing_all, gpio=gpio)
 
         try:
             logging.info('starting the server')
-            web_server.start()
-            server.start()
+            calibrator.start()
+            reloader.start()
+            for remote in remotes:
+                remote.start()
+            if emergency_socket is not None:
+                emergency_socket.start()
+            Thread(name="mcp_server_start", target=start_mcp_server, daemon=True).start()
+            ioloop.add_callback(on_started)
+            serve_webthings(server, [webthing_socket])
         except KeyboardInterrupt:
             logging.info('stopping the server')
             if switch is not None:
                 switch.terminate()
-            for awning in awnings:
-                awning.terminate()
-            web_server.stop()
-            server.stop()
+            for lane in reloader.lanes:
+                lane.terminate()
+            for remote in remotes:
+                remote.close()
+            for frontend in frontends:
+                frontend.stop()
+            if emergency_socket is not None:
+                emergency_socket.stop()
+            stop_webthings(server)
+            journal.close()
             logging.info('done')
             return
         except Exception as e:
             logging.error(e)
             sleep(3)
+            start = time.perf_counter()
 
 
 
@@ -0,0 +1,540 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import tempfile
+import subprocess
+from http.client import HTTPConnection
+from threading import Thread
+from typing import List, Dict, Any
+from awning import Motor, PiAwning, Awnings, MotionScheduler
+from awning_web import AwningWebServer
+from clock import VirtualClock
+from metrics import Metrics
+from trace_recorder import Tracer
+from gpio_backend import SimulatedGPIO
+from motor_tb6612Fng import TB6612FNGMotor, Config, create_tb6612fng
+
+
+class BenchmarkMotor(Motor):
+
+    def __init__(self, name: str, sec_per_step: float, sec_per_write: float = 0.0002):
+        self.__name = name
+        self.__sec_per_step = sec_per_step
+        self.sec_per_write = sec_per_write    # emulates the cost of a GPIO write
+
+    def terminate(self, kept_pins: List[int] = ()):
+        pass
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def sec_per_step(self) -> float:
+        return self.__sec_per_step
+
+    def stop(self):
+        time.sleep(self.sec_per_write)
+
+    def backward(self):
+        time.sleep(self.sec_per_write)
+
+    def forward(self):
+        time.sleep(self.sec_per_write)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def bench_command_latency(num_writers: int = 8, duration_sec: float = 5, listener_sec: float = 0.005) -> Dict[str, Any]:
+    awning = PiAwning(BenchmarkMotor("lane1", 0.05))
+    awning.add_listener(lambda: time.sleep(listener_sec))   # emulates the websocket fan-out of the listeners
+    latencies_ms = []
+    end_time = time.monotonic() + duration_sec
+
+    def writer():
+        while time.monotonic() < end_time:
+            start_ns = time.perf_counter_ns()
+            awning.set_position(random.randint(0, 100))
+            latencies_ms.append((time.perf_counter_ns() - start_ns) / 1_000_000)
+            time.sleep(random.uniform(0, 0.01))
+
+    writers = [Thread(target=writer, daemon=True) for _ in range(num_writers)]
+    [thread.start() for thread in writers]
+    [thread.join() for thread in writers]
+    return {"benchmark": "command_latency",
+            "writers": num_writers,
+            "commands": len(latencies_ms),
+            "p50_ms": round(percentile(latencies_ms, 50), 3),
+            "p99_ms": round(percentile(latencies_ms, 99), 3),
+            "max_ms": round(max(latencies_ms, default=0), 3)}
+
+
+def bench_http_polling(num_pollers: int = 16, duration_sec: float = 5, num_lanes: int = 4, num_stalled: int = 0) -> Dict[str, Any]:
+    lanes = [PiAwning(BenchmarkMotor("lane" + str(i + 1), 0.05)) for i in range(num_lanes)]
+    awnings = [Awnings("all", lanes)] + lanes
+    web_server = AwningWebServer(awnings, host="127.0.0.1", port=0)
+    web_server.start()
+    port = web_server.server.server_address[1]
+    # stalled clients open a connection and send an incomplete request
+    stalled = [socket.create_connection(("127.0.0.1", port)) for _ in range(num_stalled)]
+    [connection.sendall(b"GET /lane1 HTTP/1.1\r\n") for connection in stalled]
+    latencies_ms = []
+    errors = [0]
+    end_time = time.monotonic() + duration_sec
+
+    def poller(index: int):
+        connection = HTTPConnection("127.0.0.1", port)   # keep-alive connection
+        path = "/" + awnings[index % len(awnings)].name
+        while time.monotonic() < end_time:
+            start_ns = time.perf_counter_ns()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                latencies_ms.append((time.perf_counter_ns() - start_ns) / 1_000_000)
+            except Exception:
+                errors[0] += 1
+                connection.close()
+                connection = HTTPConnection("127.0.0.1", port)
+        connection.close()
+
+    pollers = [Thread(target=poller, args=(index,), daemon=True) for index in range(num_pollers)]
+    [thread.start() for thread in pollers]
+    [thread.join() for thread in pollers]
+    [connection.close() for connection in stalled]
+    web_server.stop()
+    return {"benchmark": "http_polling",
+            "pollers": num_pollers,
+            "stalled_clients": num_stalled,
+            "requests": len(latencies_ms),
+            "errors": errors[0],
+            "requests_per_sec": round(len(latencies_ms) / duration_sec, 1),
+            "p50_ms": round(percentile(latencies_ms, 50), 3),
+            "p99_ms": round(percentile(latencies_ms, 99), 3)}
+
+
+def bench_mcp_latency(num_calls: int = 50, num_lanes: int = 4) -> Dict[str, Any]:
+    import asyncio
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+    from mcp_server import MCPServer
+
+    # no command damping. The benchmark measures the bridging latency
+    lanes = [PiAwning(BenchmarkMotor("lane" + str(i + 1), 0.01), settle_sec=0, min_reversal_interval_sec=0) for i in range(num_lanes)]
+    awnings = [Awnings("all", lanes)] + lanes
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    mcp_server = MCPServer("awning_benchmark", port, awnings)
+    mcp_server.start()
+    time.sleep(2)   # wait until the server is bound
+
+    async def run() -> Dict[str, List[float]]:
+        latencies_ms = {"get_status": [], "set_position": [], "set_position_wait": []}
+        async with sse_client("http://127.0.0.1:" + str(port) + "/sse") as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                for i in range(num_calls):
+                    for tool, arguments in [("get_status", {}),
+                                            ("set_position", {"name": "lane1", "position": random.randint(0, 100)}),
+                                            ("set_position_wait", {"name": "lane2", "position": (i % 2) * 20, "wait_until_reached": True})]:
+                        start_ns = time.perf_counter_ns()
+                        result = await session.call_tool("set_position" if tool == "set_position_wait" else tool, arguments)
+                        latencies_ms[tool].append((time.perf_counter_ns() - start_ns) / 1_000_000)
+                        if result.isError:
+                            raise Exception(tool + " failed " + str(result.content))
+        return latencies_ms
+
+    latencies_ms = asyncio.run(run())
+    mcp_server.stop()
+    result = {"benchmark": "mcp_latency", "calls": num_calls}
+    for tool, values in latencies_ms.items():
+        result[tool + "_p50_ms"] = round(percentile(values, 50), 3)
+        result[tool + "_p99_ms"] = round(percentile(values, 99), 3)
+    return result
+
+
+def free_ports(num_ports: int) -> int:
+    # the first of several consecutive free ports
+    while True:
+        port = random.randint(20000, 40000)
+        try:
+            for offset in range(num_ports):
+                with socket.socket() as probe:
+                    probe.bind(("127.0.0.1", port + offset))
+            return port
+        except OSError:
+            pass
+
+
+def wait_for_response(port: int, url: str, start: float, expected_status: int = None, timeout_sec: float = 30) -> float:
+    # msec since the start until the port answers the request, if set with the expected status
+    while time.perf_counter() - start < timeout_sec:
+        try:
+            connection = HTTPConnection("127.0.0.1", port, timeout=timeout_sec)
+            connection.request("GET", url)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if expected_status is None or response.status == expected_status:
+                return (time.perf_counter() - start) * 1000
+        except OSError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError("no response on port " + str(port) + " " + url)
+
+
+def bench_startup(runs: int = 5, num_lanes: int = 4) -> Dict[str, Any]:
+    # time-to-first-response of a server process on the simulated backend
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "tb6612fng_motors.config")
+        with open(filename, "w") as file:
+            file.write("backend = simulated\n")
+            for i in range(num_lanes):
+                file.write("lane" + str(i + 1) + ", " + str(2 + i * 2) + ", " + str(3 + i * 2) + ", 0.5\n")
+        latencies_ms = {"http_bound": [], "http_ready": [], "webthing_ready": []}
+        phases = []
+        for _ in range(runs):
+            port = free_ports(3)
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "awning_webthing.py"), str(port), filename, "0", "0"],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            try:
+                latencies_ms["http_bound"].append(wait_for_response(port + 1, "/_status", start))
+                latencies_ms["http_ready"].append(wait_for_response(port + 1, "/_status", start, 200))
+                latencies_ms["webthing_ready"].append(wait_for_response(port, "/", start, 200))
+            finally:
+                process.terminate()
+                output = process.communicate(timeout=10)[1]
+            phases.extend([line[line.index("startup took"):] for line in output.splitlines() if "startup took" in line])
+    result = {"benchmark": "startup", "runs": runs, "lanes": num_lanes}
+    for name, values in latencies_ms.items():
+        result[name + "_p50_ms"] = round(percentile(values, 50), 1)
+        result[name + "_max_ms"] = round(max(values), 1)
+    result["last_phases"] = phases[-1] if len(phases) > 0 else None
+    return result
+
+
+def bench_emergency_latency(runs: int = 20, num_lanes: int = 4, num_writers: int = 4) -> Dict[str, Any]:
+    # latency of the emergency retract while the lanes are extending and writers keep the scheduler busy
+    from emergency import EmergencyRetract
+    gpio = SimulatedGPIO()
+    metrics = Metrics()
+    scheduler = MotionScheduler("emergency_benchmark", metrics=metrics)
+    lanes = [PiAwning(create_tb6612fng(Config("lane" + str(i + 1), 2 + i * 2, 3 + i * 2, 0.05), gpio, tracer=Tracer()), scheduler=scheduler, metrics=metrics, tracer=Tracer())
+             for i in range(num_lanes)]
+    group = Awnings("all", lanes)
+    emergency = EmergencyRetract(lanes, metrics)
+    is_running = [True]
+    rejected = [0]
+
+    def write():
+        while is_running[0]:
+            try:
+                group.set_position(random.randint(50, 100)).result(timeout=5)
+            except Exception:
+                rejected[0] += 1
+            time.sleep(0.001)
+
+    pins_ms, applied_ms, not_retracting = [], [], 0
+    for _ in range(runs):
+        emergency.clear("benchmark")
+        group.set_position(100).result(timeout=5)
+        time.sleep(0.2)
+        writers = [Thread(target=write, daemon=True) for _ in range(num_writers)]
+        for writer in writers:
+            writer.start()
+        time.sleep(0.05)
+        latency = emergency.retract("benchmark")["last_latency"]
+        pins_ms.append(latency["pins_ms"])
+        applied_ms.append(latency["applied_ms"])
+        time.sleep(0.05)
+        # the writers must not re-extend a lane
+        not_retracting += len([lane for lane in lanes if not lane.is_moving_backward() and lane.get_current_position() > 0])
+        is_running[0] = False
+        for writer in writers:
+            writer.join()
+        is_running[0] = True
+    return {"benchmark": "emergency_latency",
+            "runs": runs,
+            "lanes": num_lanes,
+            "pins_p50_ms": round(percentile(pins_ms, 50), 3),
+            "pins_max_ms": round(max(pins_ms), 3),
+            "applied_p50_ms": round(percentile(applied_ms, 50), 3),
+            "applied_p99_ms": round(percentile(applied_ms, 99), 3),
+            "applied_max_ms": round(max(applied_ms), 3),
+            "rejected_commands": rejected[0],
+            "lanes_not_retracting": not_retracting}
+
+
+def bench_remote_awning(num_calls: int = 50, num_lanes: int = 2, sec_per_slot: float = 0.11) -> Dict[str, Any]:
+    # a RemoteController against a second, local instance on the simulated backend. With the default sec_per_slot
+    # a full extend takes longer than the connection timeout of the remote controller
+    from remote_awning import RemoteController
+    from awning import MoveOutcome
+    gpio = SimulatedGPIO()
+    # no command damping. The benchmark measures the round trip
+    lanes = [PiAwning(create_tb6612fng(Config("lane" + str(i + 1), 2 + i * 2, 3 + i * 2, sec_per_slot), gpio, tracer=Tracer()), settle_sec=0, min_reversal_interval_sec=0, tracer=Tracer())
+             for i in range(num_lanes)]
+    web_server = AwningWebServer([Awnings("all", lanes)] + lanes, host="127.0.0.1", port=0)
+    web_server.start()
+    controller = RemoteController("127.0.0.1:" + str(web_server.server.server_address[1]), [lane.name for lane in lanes])
+    controller.start()
+    try:
+        while not controller.is_connected:
+            time.sleep(0.01)
+        remote = controller.awnings
+        latencies_ms = []
+        for i in range(num_calls):
+            start_ns = time.perf_counter_ns()
+            remote["lane2"].set_position(i % 2).result(timeout=5)
+            latencies_ms.append((time.perf_counter_ns() - start_ns) / 1_000_000)
+        remote["lane2"].set_position(0, until_reached=True).result(timeout=10)
+
+        # awaited moves hold neither a connection nor a worker, so a stop never queues behind them
+        start = time.monotonic()
+        awaited = [remote[lane.name].set_position(100, until_reached=True) for _ in range(8) for lane in lanes]
+        time.sleep(1)
+        start_ns = time.perf_counter_ns()
+        remote["lane2"].stop().result(timeout=5)
+        stop_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
+        outcome = awaited[0].result(timeout=100 * sec_per_slot * 2 + 10)
+        awaited_sec = time.monotonic() - start
+        stopped_outcome = awaited[1].result(timeout=10)
+        reached_position = lanes[0].get_current_position()
+        superseded = remote["lane1"].set_position(50, until_reached=True)
+        time.sleep(1)
+        superseding = remote["lane1"].set_position(20, until_reached=True)
+        return {"benchmark": "remote_awning",
+                "calls": num_calls,
+                "command_p50_ms": round(percentile(latencies_ms, 50), 3),
+                "command_p99_ms": round(percentile(latencies_ms, 99), 3),
+                "stop_while_awaiting_ms": round(stop_ms, 3),
+                "awaited_move_sec": round(awaited_sec, 1),
+                "awaited_outcome": outcome,
+                "stopped_outcome": stopped_outcome,
+                "reached_position": reached_position,
+                "superseded_outcome": superseded.result(timeout=10),
+                "superseding_outcome": superseding.result(timeout=100 * sec_per_slot + 10)}
+    finally:
+        controller.close()
+        web_server.stop()
+
+
+class RecordingGPIO(SimulatedGPIO):
+    # measures the command to pin latency, the reversals and the overshoot of the simulated lanes
+
+    def __init__(self, clock: VirtualClock, scheduler: MotionScheduler):
+        super().__init__(clock.monotonic, clock.sleep)
+        self.virtual_clock = clock
+        self.scheduler = scheduler
+        self.lanes: Dict[str, PiAwning] = dict()
+        self.command_time_ns: Dict[str, int] = dict()
+        self.latencies_ms: List[float] = []
+        self.overshoots: List[float] = []
+        # the last requested position of each lane and the deviation of the resting awning from it
+        self.targets: Dict[str, int] = dict()
+        self.target_errors: List[float] = []
+        self.last_direction: Dict[str, int] = dict()
+        self.reversals = 0
+
+    def on_target(self, name: str, position: int):
+        # includes requests which have been ignored as being within the slot tolerance
+        awning = self.awnings[name]
+        if name in self.targets and awning.speed == 0:
+            self.target_errors.append(abs(awning.position - self.targets[name]))
+        self.targets[name] = position
+
+    def on_command(self, name: str):
+        self.command_time_ns.setdefault(name, self.virtual_clock.monotonic_ns())
+
+    def on_command_done(self, name: str, command_time_ns: int):
+        # the command did not change a pin, e.g. the target is within the slot tolerance
+        if self.command_time_ns.get(name, None) == command_time_ns:
+            del self.command_time_ns[name]
+
+    def output(self, pin: int, value: int):
+        super().output(pin, value)
+        for awning in self.awnings.values():
+            if pin in (awning.pin_forward, awning.pin_backward) and awning.name in self.lanes:
+                command_time_ns = self.command_time_ns.pop(awning.name, None)
+                if command_time_ns is not None:
+                    self.latencies_ms.append((self.virtual_clock.monotonic_ns() - command_time_ns) / 1_000_000)
+                direction = 1 if pin == awning.pin_forward else -1
+                if value > 0:
+                    if self.last_direction.get(awning.name, direction) != direction:
+                        self.reversals += 1
+                    self.last_direction[awning.name] = direction
+                else:
+                    # the fabric coasts after the motor stops. The overshoot is measured once it has come to rest
+                    self.scheduler.schedule_in(awning.inertia_sec * 2, lambda awning=awning, direction=direction: self.__measure_overshoot(awning, direction))
+
+    def __measure_overshoot(self, awning, direction: int):
+        if self.input(awning.pin_forward) == 0 and self.input(awning.pin_backward) == 0:
+            self.overshoots.append(max(0.0, (awning.position - self.lanes[awning.name].get_current_position()) * direction))
+
+
+def slider_drag_trace(lanes: List[PiAwning], group: Awnings, hours: float, rand: random.Random) -> List[Any]:
+    # a user drags the slider of a lane. The position is updated every 50 msec
+    trace = []
+    time_sec = 60.0
+    while time_sec < hours * 3600:
+        lane = rand.choice(lanes)
+        start, end = rand.randint(0, 100), rand.randint(0, 100)
+        for step in range(20):
+            trace.append((time_sec + (step * 0.05), "set_position", {lane: int(start + ((end - start) * (step + 1) / 20))}))
+        time_sec += rand.uniform(5 * 60, 15 * 60)
+    return trace
+
+
+def scene_change_trace(lanes: List[PiAwning], group: Awnings, hours: float, rand: random.Random) -> List[Any]:
+    # scenes set all lanes at once, either to the same or to individual positions
+    trace = []
+    time_sec = 60.0
+    while time_sec < hours * 3600:
+        if rand.random() < 0.5:
+            trace.append((time_sec, "set_position", {group: rand.choice([0, 30, 60, 100])}))
+        else:
+            trace.append((time_sec, "set_position", {lane: rand.choice([0, 20, 50, 80, 100]) for lane in lanes}))
+        time_sec += rand.uniform(10 * 60, 30 * 60)
+    return trace
+
+
+def fine_adjust_trace(lanes: List[PiAwning], group: Awnings, hours: float, rand: random.Random) -> List[Any]:
+    # the lanes follow the sun by small adjustments of 3 to 10 slots
+    trace = []
+    positions = {lane: rand.randint(20, 80) for lane in lanes}
+    time_sec = 60.0
+    while time_sec < hours * 3600:
+        lane = rand.choice(lanes)
+        positions[lane] = min(100, max(0, positions[lane] + rand.choice([-1, 1]) * rand.randint(3, 10)))
+        trace.append((time_sec, "set_position", {lane: positions[lane]}))
+        time_sec += rand.uniform(2 * 60, 6 * 60)
+    return trace
+
+
+def nightly_calibration_trace(lanes: List[PiAwning], group: Awnings, hours: float, rand: random.Random) -> List[Any]:
+    # slider drags and scene changes during the day. The lanes are calibrated each night with a stagger of 2 sec
+    trace = slider_drag_trace(lanes, group, hours, rand) + scene_change_trace(lanes, group, hours, rand)
+    for day in range(int(hours // 24) + 1):
+        time_sec = (day * 24 + 3) * 3600.0
+        if time_sec < hours * 3600:
+            trace += [(time_sec + (index * 2), "calibrate", lane) for index, lane in enumerate(lanes)]
+    return sorted(trace, key=lambda entry: entry[0])
+
+
+SCENARIOS = {
+    "slider_drag": slider_drag_trace,
+    "scene_change": scene_change_trace,
+    "fine_adjust": fine_adjust_trace,
+    "nightly_calibration": nightly_calibration_trace,
+}
+
+
+def run_motion_scenario(scenario: str, hours: float, num_lanes: int = 4, sec_per_slot: float = 0.5, inertia_sec: float = 0.3, seed: int = 1, pwm: bool = False) -> Dict[str, Any]:
+    clock = VirtualClock(time.time())
+    # keeps the simulated lanes out of the default metrics and traces
+    metrics = Metrics()
+    tracer = Tracer(clock=clock)
+    scheduler = MotionScheduler("virtual_motion_scheduler", clock, metrics)
+    gpio = RecordingGPIO(clock, scheduler)
+    rand = random.Random(seed)
+    lanes = []
+    for index in range(num_lanes):
+        name = "lane" + str(index + 1)
+        # the real motor speed deviates slightly from the configured one
+        pin_pwm = 100 + index if pwm else 0
+        gpio.add_awning(name, index * 2 + 2, index * 2 + 3, sec_per_slot, inertia_sec, speed_factor=rand.uniform(0.98, 1.02), pin_pwm=pin_pwm)
+        lanes.append(PiAwning(TB6612FNGMotor(name, index * 2 + 2, index * 2 + 3, sec_per_slot, gpio=gpio, tracer=tracer, pin_pwm=pin_pwm), scheduler=scheduler, metrics=metrics, tracer=tracer))
+        gpio.lanes[name] = lanes[-1]
+    group = Awnings("all", lanes)
+
+    def run_step(action: str, argument: Any):
+        if action == "calibrate":
+            argument.calibrate_async()
+            return
+        for awning, position in argument.items():
+            targets = lanes if awning is group else [awning]
+            [gpio.on_command(lane.name) for lane in targets]
+            [gpio.on_target(lane.name, position) for lane in targets]
+            future = awning.set_position(position)
+            for lane in targets:
+                future.add_done_callback(lambda _, name=lane.name, command_time_ns=gpio.command_time_ns.get(lane.name, None): gpio.on_command_done(name, command_time_ns))
+
+    trace = SCENARIOS[scenario](lanes, group, hours, rand)
+    for time_sec, action, argument in trace:
+        scheduler.schedule(int(time_sec * 1_000_000_000), lambda action=action, argument=argument: run_step(action, argument))
+
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    # includes some time to complete the last moves
+    scheduler.run_until(int(((hours * 3600) + (200 * sec_per_slot)) * 1_000_000_000))
+    cpu_sec = time.thread_time() - start_cpu
+    wall_sec = time.perf_counter() - start_wall
+    errors = [abs(gpio.awnings[lane.name].position - lane.get_current_position()) for lane in lanes]
+    return {"scenario": scenario,
+            "drive": "pwm" if pwm else "on_off",
+            "simulated_hours": hours,
+            "lanes": num_lanes,
+            "steps": len(trace),
+            "wall_sec": round(wall_sec, 3),
+            "final_position_error_mean_slots": round(sum(errors) / len(errors), 3),
+            "final_position_error_max_slots": round(max(errors), 3),
+            "overshoot_p50_slots": round(percentile(gpio.overshoots, 50), 3),
+            "overshoot_max_slots": round(max(gpio.overshoots, default=0), 3),
+            "target_error_p50_slots": round(percentile(gpio.target_errors, 50), 3),
+            "target_error_max_slots": round(max(gpio.target_errors, default=0), 3),
+            "reversals": gpio.reversals,
+            "motor_on_sec": round(sum([awning.motor_on_sec for awning in gpio.awnings.values()]), 1),
+            "end_stop_hits": sum([awning.end_stop_hits for awning in gpio.awnings.values()]),
+            "cpu_ms_per_lane": round(cpu_sec * 1000 / num_lanes, 3),
+            "cpu_ms_per_lane_hour": round(cpu_sec * 1000 / num_lanes / hours, 3),
+            "command_to_pin_p50_ms": round(percentile(gpio.latencies_ms, 50), 3),
+            "command_to_pin_p99_ms": round(percentile(gpio.latencies_ms, 99), 3),
+            "command_to_pin_max_ms": round(max(gpio.latencies_ms, default=0), 3)}
+
+
+def bench_motion_accuracy(hours: float = 24, seed: int = 1) -> Dict[str, Any]:
+    return {"benchmark": "motion_accuracy",
+            "scenarios": [run_motion_scenario(scenario, hours, seed=seed, pwm=pwm) for scenario in SCENARIOS.keys() for pwm in (False, True)]}
+
+
+BENCHMARKS = {
+    "command_latency": lambda args: bench_command_latency(args.writers, args.duration),
+    "emergency_latency": lambda args: bench_emergency_latency(args.runs, num_writers=args.writers),
+    "http_polling": lambda args: bench_http_polling(args.writers, args.duration, num_stalled=args.stalled),
+    "mcp_latency": lambda args: bench_mcp_latency(),
+    "motion_accuracy": lambda args: bench_motion_accuracy(args.hours, args.seed),
+    "remote_awning": lambda args: bench_remote_awning(),
+    "startup": lambda args: bench_startup(args.runs),
+}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description='awning benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS.keys()))
+    parser.add_argument('--writers', type=int, default=8, help='number of concurrent writers or pollers')
+    parser.add_argument('--duration', type=float, default=5, help='benchmark duration in sec')
+    parser.add_argument('--stalled', type=int, default=0, help='number of stalled http clients')
+    parser.add_argument('--hours', type=float, default=24, help='simulated hours of the motion benchmarks')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generated command traces')
+    parser.add_argument('--runs', type=int, default=5, help='number of server starts or emergency retracts')
+    parser.add_argument('--output', help='writes the json result to the file, e.g. to compare versions')
+    args = parser.parse_args()
+    result = BENCHMARKS[args.benchmark](args)
+    print(json.dumps(result))
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    sys.exit(0)
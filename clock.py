@@ -0,0 +1,44 @@
+import time
+from threading import Lock
+
+
+class Clock:
+
+    def monotonic_ns(self) -> int:
+        return time.monotonic_ns()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        return time.time()
+
+
+SYSTEM_CLOCK = Clock()
+
+
+class VirtualClock(Clock):
+    # a manually advanced clock. Hours of operation can be simulated within seconds
+
+    def __init__(self, start_time: float = 0):
+        self.__lock = Lock()
+        self.__now_ns = 0
+        self.__start_time = start_time
+
+    def monotonic_ns(self) -> int:
+        return self.__now_ns
+
+    def monotonic(self) -> float:
+        return self.__now_ns / 1_000_000_000
+
+    def time(self) -> float:
+        return self.__start_time + (self.__now_ns / 1_000_000_000)
+
+    def advance_to(self, now_ns: int):
+        with self.__lock:
+            # the virtual time never goes backwards
+            if now_ns > self.__now_ns:
+                self.__now_ns = now_ns
+
+    def sleep(self, sec: float):
+        self.advance_to(self.__now_ns + int(sec * 1_000_000_000))
@@ -0,0 +1,98 @@
+import os
+import time
+import logging
+from threading import Thread, Lock
+from typing import List, Dict, Callable, Optional
+from awning import Motor, PiAwning
+from metrics import Metrics
+from trace_recorder import Tracer
+from motor_tb6612Fng import Config, load_tb6612fng_configs
+
+
+class ConfigReloader:
+    # watches the motor config file and applies the changed lanes without restarting the servers
+
+    def __init__(self, filename: str, lanes: List[PiAwning], create_motor: Callable[[Config], Motor], create_lane: Callable[[Motor], PiAwning],
+                 interval_sec: float = 2, metrics: Metrics = None, tracer: Tracer = None):
+        self.filename = filename
+        self.interval_sec = interval_sec
+        self.lanes = list(lanes)
+        self.__create_motor = create_motor
+        self.__create_lane = create_lane
+        self.__metrics = Metrics.default() if metrics is None else metrics
+        self.__tracer = Tracer.default() if tracer is None else tracer
+        self.__lock = Lock()
+        self.__listeners = []
+        self.__configs = {config.name: config for config in load_tb6612fng_configs(filename)}
+        self.__modified = self.__modification()
+
+    def add_listener(self, listener: Callable[[List[PiAwning]], None]):
+        # called with the new lanes after a reload changed them
+        self.__listeners.append(listener)
+
+    def start(self):
+        Thread(name="config_reloader", target=self.__watch, daemon=True).start()
+
+    def __modification(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.filename)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def __watch(self):
+        while True:
+            time.sleep(self.interval_sec)
+            try:
+                modified = self.__modification()
+                if modified != self.__modified and modified is not None:
+                    self.__modified = modified
+                    self.reload()
+            except Exception as e:
+                logging.warning("error occurred on reloading " + self.filename + " " + str(e))
+
+    def reload(self) -> bool:
+        with self.__lock:
+            configs = {config.name: config for config in load_tb6612fng_configs(self.filename)}
+            lanes_by_name: Dict[str, PiAwning] = {lane.name: lane for lane in self.lanes}
+            removed = [name for name in lanes_by_name.keys() if name not in configs]
+            changed = [name for name in lanes_by_name.keys() if name in configs and configs[name] != self.__configs.get(name, None)]
+            added = [name for name in configs.keys() if name not in lanes_by_name]
+            if len(removed) + len(changed) + len(added) == 0:
+                return False
+
+            # removed lanes release their pins first. The pins may be reused by changed or added lanes
+            for name in removed:
+                logging.info("config reload: remove " + name)
+                lane = lanes_by_name.pop(name)
+                try:
+                    lane.stop().result(timeout=5)
+                    lane.terminate()
+                except Exception as e:
+                    logging.warning("error occurred on removing " + name + " " + str(e))
+                self.__metrics.remove({"lane": name})
+                self.__tracer.remove(name)
+            for name in changed:
+                logging.info("config reload: update " + name + " " + str(configs[name]))
+                try:
+                    lanes_by_name[name].replace_motor(lambda config=configs[name]: self.__create_motor(config)).result(timeout=5)
+                except Exception as e:
+                    logging.warning("error occurred on updating " + name + " " + str(e))
+            for name in added:
+                logging.info("config reload: add " + name)
+                try:
+                    lanes_by_name[name] = self.__create_lane(self.__create_motor(configs[name]))
+                except Exception as e:
+                    logging.warning("error occurred on adding " + name + " " + str(e))
+                    del configs[name]
+
+            self.__configs = configs
+            # the lanes keep the order of the config file
+            self.lanes = [lanes_by_name[name] for name in configs.keys() if name in lanes_by_name]
+            lanes = list(self.lanes)
+        for listener in self.__listeners:
+            try:
+                listener(lanes)
+            except Exception as e:
+                logging.warning("error occurred on notifying config reload " + str(e))
+        return True
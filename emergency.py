@@ -0,0 +1,175 @@
+import os
+import time
+import json
+import socket
+import logging
+from os import path
+from threading import Thread, Lock
+from concurrent.futures import wait
+from typing import List, Dict, Any, Callable, Optional
+from awning import PiAwning
+from remote_awning import RemoteController
+from metrics import Metrics
+
+
+class EmergencyRetract:
+    # priority channel, e.g. on wind. All lanes are retracted at once and further extending is rejected until the lockout is cleared
+
+    def __init__(self, lanes: List[PiAwning], metrics: Metrics = None, applied_timeout_sec: float = 1):
+        self.lanes = lanes
+        self.applied_timeout_sec = applied_timeout_sec
+        self.__lock = Lock()
+        self.__listeners = []
+        self.__remotes: List[RemoteController] = []
+        self.__source = None
+        self.__since = None
+        self.__last_latencies_ms = None
+        metrics = Metrics.default() if metrics is None else metrics
+        self.__pins_sec = metrics.histogram("awning_emergency_retract_pins_seconds", "latency between the emergency trigger and the backward pins of all lanes")
+        self.__applied_sec = metrics.histogram("awning_emergency_retract_applied_seconds", "latency between the emergency trigger and the retract movement of all lanes")
+        metrics.gauge("awning_emergency_lockout", "1, if the emergency lockout is active", lambda: 1 if self.is_active else 0)
+
+    def set_awnings(self, lanes: List[PiAwning]):
+        # lanes added while the lockout is active are retracted as well
+        self.lanes = lanes
+        if self.is_active:
+            for lane in lanes:
+                if not lane.is_locked_out():
+                    lane.emergency_retract()
+
+    def set_remotes(self, remotes: List[RemoteController]):
+        # the lockout is forwarded to the controllers of the remote lanes
+        self.__remotes = remotes
+        if self.is_active:
+            self.__forward("retract")
+
+    def __forward(self, action: str):
+        for remote in self.__remotes:
+            remote.emergency(action).add_done_callback(lambda future, remote=remote: self.__on_forwarded(remote, action, future))
+
+    def __on_forwarded(self, remote: RemoteController, action: str, future):
+        if future.exception() is not None:
+            logging.warning("could not forward emergency " + action + " to " + remote.address + " " + str(future.exception()))
+
+    def add_listener(self, listener: Callable[[], None]):
+        self.__listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]):
+        if listener in self.__listeners:
+            self.__listeners.remove(listener)
+
+    @property
+    def is_active(self) -> bool:
+        return self.__source is not None
+
+    def retract(self, source: str, wait_until_applied: bool = True) -> Dict[str, Any]:
+        start_ns = time.perf_counter_ns()
+        lanes = self.lanes
+        # the motors are driven backward by the calling thread. The scheduler aligns the movements with priority
+        futures = [lane.emergency_retract() for lane in lanes]
+        pins_ns = time.perf_counter_ns() - start_ns
+        self.__pins_sec.observe(pins_ns / 1_000_000_000)
+        with self.__lock:
+            is_new = self.__source is None
+            if is_new:
+                self.__source = source
+                self.__since = time.time()
+        if is_new:
+            # forwarded on activation only. Controllers which include each other as remote do not bounce the retract
+            self.__forward("retract")
+        if wait_until_applied:
+            done, not_done = wait(futures, timeout=self.applied_timeout_sec)
+            applied_ns = time.perf_counter_ns() - start_ns
+            if len(not_done) > 0:
+                logging.warning("emergency retract of " + str(len(not_done)) + " lane(s) not applied within " + str(self.applied_timeout_sec) + " sec")
+            else:
+                self.__applied_sec.observe(applied_ns / 1_000_000_000)
+            self.__last_latencies_ms = {"pins_ms": round(pins_ns / 1_000_000, 3), "applied_ms": round(applied_ns / 1_000_000, 3)}
+        else:
+            self.__last_latencies_ms = {"pins_ms": round(pins_ns / 1_000_000, 3)}
+        logging.warning("EMERGENCY RETRACT triggered by " + source + ". " + str(len(lanes)) + " lane(s) driven backward within " + str(round(pins_ns / 1_000_000, 3)) + " ms")
+        if is_new:
+            self.__notify_listeners()
+        return self.status()
+
+    def clear(self, source: str) -> Dict[str, Any]:
+        with self.__lock:
+            was_active = self.__source is not None
+            self.__source = None
+            self.__since = None
+        for lane in self.lanes:
+            lane.clear_lockout()
+        if was_active:
+            self.__forward("clear")
+            logging.warning("emergency lockout cleared by " + source)
+            self.__notify_listeners()
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        return {"active": self.is_active, "source": self.__source, "since": self.__since, "last_latency": self.__last_latencies_ms,
+                "locked_lanes": [lane.name for lane in self.lanes if lane.is_locked_out()]}
+
+    def __notify_listeners(self):
+        for listener in self.__listeners:
+            try:
+                listener()
+            except Exception as e:
+                logging.warning("error occurred on notifying emergency listener " + str(e))
+
+
+class EmergencySocket:
+    # local trigger, e.g. of a wind sensor script: echo retract | nc -U /run/awning/emergency.sock
+    # supported commands are retract, clear and status. The status is returned as json
+
+    def __init__(self, socket_path: str, emergency: EmergencyRetract):
+        self.socket_path = socket_path
+        self.emergency = emergency
+        if path.exists(socket_path):
+            os.remove(socket_path)
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.bind(socket_path)
+        self.__socket.listen(8)
+
+    def start(self):
+        Thread(name="emergency_socket", target=self.__accept, daemon=True).start()
+        logging.info("emergency socket listening on " + self.socket_path)
+
+    def stop(self):
+        self.__socket.close()
+        if path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __accept(self):
+        while True:
+            try:
+                connection, _ = self.__socket.accept()
+            except OSError:
+                return   # closed
+            with connection:
+                try:
+                    connection.settimeout(5)
+                    command = connection.makefile("r").readline().strip().lower()
+                    if command == "retract":
+                        status = self.emergency.retract("socket")
+                    elif command == "clear":
+                        status = self.emergency.clear("socket")
+                    elif command == "status":
+                        status = self.emergency.status()
+                    else:
+                        status = {"error": "unknown command " + command + ". Supported: retract, clear, status"}
+                    connection.sendall((json.dumps(status) + "\n").encode("utf-8"))
+                except Exception as e:
+                    logging.warning("error occurred on emergency socket " + str(e))
+
+
+def load_emergency_socket(filename: str, emergency: EmergencyRetract) -> Optional[EmergencySocket]:
+    # the socket is defined by a setting line of the config file, e.g. emergency_socket = /run/awning/emergency.sock
+    if path.exists(filename):
+        with open(filename, "r") as file:
+            for line in file.readlines():
+                line = line.strip()
+                if not line.startswith("#") and "=" in line:
+                    key, value = [part.strip() for part in line.split("=", 1)]
+                    if key.lower() == "emergency_socket":
+                        return EmergencySocket(value, emergency)
+    return None
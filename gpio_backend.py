@@ -0,0 +1,323 @@
+import time
+import random
+import logging
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Callable, Dict, List
+
+
+class GPIOBackend(ABC):
+
+    @abstractmethod
+    def setup_output(self, pin: int, initial: int = 0):
+        pass
+
+    @abstractmethod
+    def setup_input(self, pin: int):
+        # inputs are pulled down
+        pass
+
+    @abstractmethod
+    def output(self, pin: int, value: int):
+        pass
+
+    @abstractmethod
+    def input(self, pin: int) -> int:
+        pass
+
+    @abstractmethod
+    def setup_pwm(self, pin: int, frequency_hz: int = 1000):
+        # the pwm output starts with duty cycle 0
+        pass
+
+    @abstractmethod
+    def set_duty_cycle(self, pin: int, duty: float):
+        # duty 0.0 (off) to 1.0 (full speed)
+        pass
+
+    @abstractmethod
+    def add_edge_callback(self, pin: int, callback: Callable[[int], None]):
+        # the callback is called with the pin on rising and falling edges
+        pass
+
+    @abstractmethod
+    def cleanup(self, pin: int):
+        pass
+
+
+class RPiGPIOBackend(GPIOBackend):
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.__gpio = GPIO
+        self.__gpio.setmode(GPIO.BCM)
+        self.__pwms = dict()
+
+    def setup_output(self, pin: int, initial: int = 0):
+        self.__gpio.setup(pin, self.__gpio.OUT, initial=initial)
+
+    def setup_input(self, pin: int):
+        self.__gpio.setup(pin, self.__gpio.IN, self.__gpio.PUD_DOWN)
+
+    def output(self, pin: int, value: int):
+        self.__gpio.output(pin, value)
+
+    def input(self, pin: int) -> int:
+        return self.__gpio.input(pin)
+
+    def setup_pwm(self, pin: int, frequency_hz: int = 1000):
+        self.__gpio.setup(pin, self.__gpio.OUT, initial=0)
+        self.__pwms[pin] = self.__gpio.PWM(pin, frequency_hz)
+        self.__pwms[pin].start(0)
+
+    def set_duty_cycle(self, pin: int, duty: float):
+        self.__pwms[pin].ChangeDutyCycle(duty * 100)
+
+    def add_edge_callback(self, pin: int, callback: Callable[[int], None]):
+        self.__gpio.add_event_detect(pin, self.__gpio.BOTH)
+        self.__gpio.add_event_callback(pin, callback)
+
+    def cleanup(self, pin: int):
+        if pin in self.__pwms:
+            self.__pwms.pop(pin).stop()
+        self.__gpio.cleanup(pin)
+
+
+class LgpioBackend(GPIOBackend):
+
+    def __init__(self, chip: int = 0):
+        import lgpio
+        self.__lgpio = lgpio
+        self.__handle = lgpio.gpiochip_open(chip)
+        self.__callbacks = dict()
+        self.__pwm_frequencies = dict()
+
+    def setup_output(self, pin: int, initial: int = 0):
+        self.__lgpio.gpio_claim_output(self.__handle, pin, initial)
+
+    def setup_input(self, pin: int):
+        self.__lgpio.gpio_claim_input(self.__handle, pin, self.__lgpio.SET_PULL_DOWN)
+
+    def output(self, pin: int, value: int):
+        self.__lgpio.gpio_write(self.__handle, pin, value)
+
+    def input(self, pin: int) -> int:
+        return self.__lgpio.gpio_read(self.__handle, pin)
+
+    def setup_pwm(self, pin: int, frequency_hz: int = 1000):
+        self.__lgpio.gpio_claim_output(self.__handle, pin, 0)
+        self.__pwm_frequencies[pin] = frequency_hz
+
+    def set_duty_cycle(self, pin: int, duty: float):
+        self.__lgpio.tx_pwm(self.__handle, pin, self.__pwm_frequencies[pin], duty * 100)
+
+    def add_edge_callback(self, pin: int, callback: Callable[[int], None]):
+        self.__lgpio.gpio_claim_alert(self.__handle, pin, self.__lgpio.BOTH_EDGES, self.__lgpio.SET_PULL_DOWN)
+        self.__callbacks[pin] = self.__lgpio.callback(self.__handle, pin, self.__lgpio.BOTH_EDGES, lambda chip, gpio, level, tick: callback(gpio))
+
+    def cleanup(self, pin: int):
+        if pin in self.__callbacks:
+            self.__callbacks.pop(pin).cancel()
+        if self.__pwm_frequencies.pop(pin, None) is not None:
+            self.__lgpio.tx_pwm(self.__handle, pin, 0, 0)
+        self.__lgpio.gpio_free(self.__handle, pin)
+
+
+class SimulatedAwning:
+    # the physical awning driven by a simulated TB6612FNG channel. The position is measured in slots (0 = retracted, 100 = extended)
+
+    def __init__(self, name: str, pin_forward: int, pin_backward: int, sec_per_slot: float, inertia_sec: float = 0.2, speed_factor: float = 1.0,
+                 position: float = 0, clock: Callable[[], float] = time.monotonic, pin_pwm: int = 0):
+        self.name = name
+        self.pin_forward = pin_forward
+        self.pin_backward = pin_backward
+        # without pwm pin the motor runs at full speed. The speed is proportional to the duty cycle
+        self.pin_pwm = pin_pwm
+        self.__duty = 0.0 if pin_pwm > 0 else 1.0
+        self.__direction = 0
+        # the real speed may deviate from the configured one, e.g. speed_factor=0.98
+        self.max_speed = speed_factor / sec_per_slot
+        # time to accelerate from standstill to full speed and vice versa
+        self.inertia_sec = inertia_sec
+        self.end_stop_hits = 0
+        self.motor_on_sec = 0.0
+        self.__clock = clock
+        self.__lock = Lock()
+        self.__position = float(position)
+        self.__speed = 0.0
+        self.__target_speed = 0.0
+        self.__last_time = clock()
+
+    def __advance(self):
+        now = self.__clock()
+        elapsed_sec = now - self.__last_time
+        self.__last_time = now
+        if self.__target_speed != 0:
+            self.motor_on_sec += elapsed_sec
+        acceleration = self.max_speed / self.inertia_sec if self.inertia_sec > 0 else 0
+        while elapsed_sec > 0:
+            if self.__speed == self.__target_speed or acceleration == 0:
+                self.__speed = self.__target_speed
+                self.__position += self.__speed * elapsed_sec
+                elapsed_sec = 0
+            else:
+                sign = 1 if self.__target_speed > self.__speed else -1
+                ramp_sec = min(elapsed_sec, abs(self.__target_speed - self.__speed) / acceleration)
+                self.__position += (self.__speed * ramp_sec) + (0.5 * sign * acceleration * ramp_sec * ramp_sec)
+                self.__speed = self.__target_speed if ramp_sec < elapsed_sec else self.__speed + (sign * acceleration * ramp_sec)
+                elapsed_sec -= ramp_sec
+            if self.__position <= 0 or self.__position >= 100:
+                # the end stop blocks the fabric. The motor keeps running without moving
+                self.__position = min(100.0, max(0.0, self.__position))
+                if self.__speed != 0:
+                    self.end_stop_hits += 1
+                self.__speed = 0.0
+                if (self.__position == 0 and self.__target_speed < 0) or (self.__position == 100 and self.__target_speed > 0):
+                    elapsed_sec = 0
+
+    def on_pins_changed(self, forward: int, backward: int):
+        with self.__lock:
+            self.__advance()
+            if forward > 0 and backward == 0:
+                self.__direction = 1
+            elif backward > 0 and forward == 0:
+                self.__direction = -1
+            else:
+                self.__direction = 0
+            self.__target_speed = self.__direction * self.max_speed * self.__duty
+
+    def on_duty_cycle_changed(self, duty: float):
+        with self.__lock:
+            self.__advance()
+            self.__duty = min(1.0, max(0.0, duty))
+            self.__target_speed = self.__direction * self.max_speed * self.__duty
+
+    @property
+    def position(self) -> float:
+        with self.__lock:
+            self.__advance()
+            return self.__position
+
+    @property
+    def speed(self) -> float:
+        with self.__lock:
+            self.__advance()
+            return self.__speed
+
+
+class SimulatedGPIO(GPIOBackend):
+    # hardware-free backend. Output pins drive the attached simulated awnings, input pins are set by the simulated switch
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep, seed: int = 0):
+        self.clock = clock
+        self.sleep = sleep
+        self.__random = random.Random(seed)
+        self.__lock = Lock()
+        self.__levels: Dict[int, int] = dict()
+        self.__duty_cycles: Dict[int, float] = dict()
+        self.__inputs = set()
+        self.__callbacks: Dict[int, List[Callable[[int], None]]] = dict()
+        self.__awnings_by_pin: Dict[int, SimulatedAwning] = dict()
+        self.awnings: Dict[str, SimulatedAwning] = dict()
+
+    def add_awning(self, name: str, pin_forward: int, pin_backward: int, sec_per_slot: float, inertia_sec: float = 0.2, speed_factor: float = 1.0,
+                   pin_pwm: int = 0) -> SimulatedAwning:
+        # a reconfigured awning keeps its physical position
+        with self.__lock:
+            previous = self.awnings.get(name, None)
+            awning = SimulatedAwning(name, pin_forward, pin_backward, sec_per_slot, inertia_sec, speed_factor, 0 if previous is None else previous.position,
+                                     clock=self.clock, pin_pwm=pin_pwm)
+            if previous is not None:
+                self.__awnings_by_pin.pop(previous.pin_forward, None)
+                self.__awnings_by_pin.pop(previous.pin_backward, None)
+                if previous.pin_pwm > 0:
+                    self.__awnings_by_pin.pop(previous.pin_pwm, None)
+            self.awnings[name] = awning
+            self.__awnings_by_pin[pin_forward] = awning
+            self.__awnings_by_pin[pin_backward] = awning
+            if pin_pwm > 0:
+                self.__awnings_by_pin[pin_pwm] = awning
+            return awning
+
+    def setup_output(self, pin: int, initial: int = 0):
+        self.output(pin, initial)
+
+    def setup_input(self, pin: int):
+        with self.__lock:
+            self.__inputs.add(pin)
+            self.__levels[pin] = 0
+
+    def output(self, pin: int, value: int):
+        with self.__lock:
+            self.__levels[pin] = value
+            awning = self.__awnings_by_pin.get(pin, None)
+            if awning is not None:
+                awning.on_pins_changed(self.__levels.get(awning.pin_forward, 0), self.__levels.get(awning.pin_backward, 0))
+
+    def input(self, pin: int) -> int:
+        return self.__levels.get(pin, 0)
+
+    def setup_pwm(self, pin: int, frequency_hz: int = 1000):
+        self.set_duty_cycle(pin, 0)
+
+    def set_duty_cycle(self, pin: int, duty: float):
+        with self.__lock:
+            self.__duty_cycles[pin] = duty
+            awning = self.__awnings_by_pin.get(pin, None)
+            if awning is not None and awning.pin_pwm == pin:
+                awning.on_duty_cycle_changed(duty)
+
+    def duty_cycle(self, pin: int) -> float:
+        return self.__duty_cycles.get(pin, 0)
+
+    def add_edge_callback(self, pin: int, callback: Callable[[int], None]):
+        with self.__lock:
+            self.__callbacks.setdefault(pin, []).append(callback)
+
+    def cleanup(self, pin: int):
+        with self.__lock:
+            self.__callbacks.pop(pin, None)
+            self.__inputs.discard(pin)
+
+    def set_input(self, pin: int, level: int):
+        with self.__lock:
+            if self.__levels.get(pin, 0) == level:
+                return
+            self.__levels[pin] = level
+            callbacks = list(self.__callbacks.get(pin, []))
+        for callback in callbacks:
+            try:
+                callback(pin)
+            except Exception as e:
+                logging.warning("error occurred on edge callback of pin " + str(pin) + " " + str(e))
+
+    def bounce(self, pin: int, level: int, num_bounces: int = 3, max_bounce_sec: float = 0.003):
+        # a mechanical contact toggles several times before it settles on the new level
+        for _ in range(num_bounces):
+            self.set_input(pin, level)
+            self.sleep(self.__random.uniform(0, max_bounce_sec))
+            self.set_input(pin, 1 - level)
+            self.sleep(self.__random.uniform(0, max_bounce_sec))
+        self.set_input(pin, level)
+
+    def press(self, pin: int, hold_sec: float = 0.1, num_bounces: int = 3):
+        self.bounce(pin, 1, num_bounces)
+        self.sleep(hold_sec)
+        self.bounce(pin, 0, num_bounces)
+
+
+BACKEND_RPI = "rpi"
+BACKEND_LGPIO = "lgpio"
+BACKEND_SIMULATED = "simulated"
+
+
+def create_backend(name: str = BACKEND_RPI) -> GPIOBackend:
+    name = name.strip().lower()
+    if name == BACKEND_RPI:
+        return RPiGPIOBackend()
+    elif name == BACKEND_LGPIO:
+        return LgpioBackend()
+    elif name == BACKEND_SIMULATED:
+        return SimulatedGPIO()
+    else:
+        raise ValueError("unsupported gpio backend " + name + ". Available: " + ", ".join([BACKEND_RPI, BACKEND_LGPIO, BACKEND_SIMULATED]))
@@ -1,6 +1,10 @@
 import asyncio
 from mcp.server.fastmcp import FastMCP
 from threading import Thread
+from typing import List, Dict, Any
+from awning import Awning, set_positions
+from awning_web import awning_status
+from emergency import EmergencyRetract
 import logging
 
 
@@ -8,10 +12,65 @@ import logging
 
 class MCPServer:
 
-    def __init__(self, name: str, port: int):
+    def __init__(self, name: str, port: int, awnings: List[Awning] = None, emergency: EmergencyRetract = None):
         self.port = port
+        self.emergency = emergency
         self.mcp = FastMCP(name, host='0.0.0.0', port=self.port)
         self.new_loop = asyncio.new_event_loop()
+        self.move_timeout_sec = 5 * 60
+        self.set_awnings([] if awnings is None else awnings)
+        self.__register_tools()
+
+    def set_awnings(self, awnings: List[Awning]):
+        self.awnings_by_name = {awning.name: awning for awning in awnings}
+
+    def __awning(self, name: str) -> Awning:
+        awning = self.awnings_by_name.get(name, None)
+        if awning is None:
+            raise ValueError("unknown awning " + name + ". Available: " + ", ".join(self.awnings_by_name.keys()))
+        return awning
+
+    async def __set_positions(self, positions: Dict[str, int], wait_until_reached: bool) -> Dict[str, Any]:
+        awnings = {self.__awning(name): int(position) for name, position in positions.items()}
+        # the threaded awning core is called by a worker thread. Its futures are awaited without blocking the event loop
+        futures = await asyncio.to_thread(set_positions, awnings, wait_until_reached)
+        results = await asyncio.wait_for(asyncio.gather(*[asyncio.wrap_future(future) for future in futures.values()]), self.move_timeout_sec)
+        return {awning.name: {'result': result, **awning_status(awning)} for awning, result in zip(futures.keys(), results)}
+
+    def __register_tools(self):
+
+        @self.mcp.tool()
+        async def list_awnings() -> List[str]:
+            """Lists the names of the available awnings. The awning 'all' controls all lanes together"""
+            return list(self.awnings_by_name.keys())
+
+        @self.mcp.tool()
+        async def get_status() -> Dict[str, Any]:
+            """Returns the target position, current position (0 = retracted, 100 = extended), moving flags and ETA of all awnings"""
+            awnings = list(self.awnings_by_name.values())
+            return await asyncio.to_thread(lambda: {awning.name: awning_status(awning) for awning in awnings})
+
+        @self.mcp.tool()
+        async def set_position(name: str, position: int, wait_until_reached: bool = False) -> Dict[str, Any]:
+            """Moves an awning to the position (0 = retracted, 100 = extended). If wait_until_reached is set, returns after the move is completed"""
+            return await self.__set_positions({name: position}, wait_until_reached)
+
+        @self.mcp.tool(name="set_positions")
+        async def set_many_positions(positions: Dict[str, int], wait_until_reached: bool = False) -> Dict[str, Any]:
+            """Moves several awnings at once, e.g. {"lane1": 30, "lane2": 80}. If wait_until_reached is set, returns after all moves are completed or superseded"""
+            return await self.__set_positions(positions, wait_until_reached)
+
+        if self.emergency is not None:
+
+            @self.mcp.tool()
+            async def emergency_retract() -> Dict[str, Any]:
+                """Retracts all awnings immediately, e.g. on strong wind. Extending is rejected until the lockout is cleared by clear_emergency_lockout"""
+                return await asyncio.to_thread(self.emergency.retract, "mcp")
+
+            @self.mcp.tool()
+            async def clear_emergency_lockout() -> Dict[str, Any]:
+                """Clears the lockout of an emergency retract. The awnings can be extended again"""
+                return await asyncio.to_thread(self.emergency.clear, "mcp")
 
     async def __run_async(self):
         await self.mcp.run_sse_async()
@@ -31,5 +90,3 @@ class MCPServer:
         logging.info("MCP Server stopped")
 
 # claude mcp add --transport sse energyTest http://192.168.1.99:9843/sse
-
-
@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import List, Dict, Callable, Tuple
+
+
+def render_labels(labels: Dict[str, str]) -> str:
+    if labels is None or len(labels) == 0:
+        return ""
+    return "{" + ",".join([key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for key, value in labels.items()]) + "}"
+
+
+class Counter:
+    __slots__ = ('labels', 'value')
+
+    def __init__(self, labels: str):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def render(self, name: str) -> List[str]:
+        return [name + self.labels + " " + str(self.value)]
+
+
+class Gauge:
+    __slots__ = ('labels', 'callback')
+
+    def __init__(self, labels: str, callback: Callable[[], float]):
+        # the value is read on rendering only
+        self.labels = labels
+        self.callback = callback
+
+    def render(self, name: str) -> List[str]:
+        return [name + self.labels + " " + str(self.callback())]
+
+
+class Histogram:
+    __slots__ = ('labels', 'bounds', 'counts', 'sum', 'count', 'lock', 'bucket_labels')
+    LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    DURATION_BOUNDS = (1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+
+    def __init__(self, labels: str, bounds: Tuple[float, ...]):
+        self.labels = labels
+        self.bounds = bounds
+        # the bucket counts are preallocated. Observing a value does not allocate
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+        prefix = labels[1:-1] + "," if len(labels) > 0 else ""
+        self.bucket_labels = ["{" + prefix + 'le="' + str(bound) + '"}' for bound in bounds] + ["{" + prefix + 'le="+Inf"}']
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name: str) -> List[str]:
+        with self.lock:
+            counts = list(self.counts)
+            total_sum, total_count = self.sum, self.count
+        lines = []
+        cumulated = 0
+        for bucket_labels, count in zip(self.bucket_labels, counts):
+            cumulated += count
+            lines.append(name + "_bucket" + bucket_labels + " " + str(cumulated))
+        lines.append(name + "_sum" + self.labels + " " + str(total_sum))
+        lines.append(name + "_count" + self.labels + " " + str(total_count))
+        return lines
+
+
+class MetricFamily:
+
+    def __init__(self, name: str, help: str, type: str):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.metrics = dict()
+
+
+class Metrics:
+    # registry of the metrics in the prometheus text format. The metrics are created once and updated in place on the hot path
+    __default = None
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__families: Dict[str, MetricFamily] = dict()
+
+    @staticmethod
+    def default():
+        if Metrics.__default is None:
+            Metrics.__default = Metrics()
+        return Metrics.__default
+
+    def __get_or_create(self, name: str, help: str, type: str, labels: Dict[str, str], create):
+        rendered_labels = render_labels(labels)
+        with self.__lock:
+            family = self.__families.get(name, None)
+            if family is None:
+                family = MetricFamily(name, help, type)
+                self.__families[name] = family
+            metric = family.metrics.get(rendered_labels, None)
+            if metric is None:
+                metric = create(rendered_labels)
+                family.metrics[rendered_labels] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels: Dict[str, str] = None) -> Counter:
+        return self.__get_or_create(name, help, "counter", labels, lambda rendered_labels: Counter(rendered_labels))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], float], labels: Dict[str, str] = None) -> Gauge:
+        gauge = self.__get_or_create(name, help, "gauge", labels, lambda rendered_labels: Gauge(rendered_labels, callback))
+        gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, help: str, labels: Dict[str, str] = None, bounds: Tuple[float, ...] = Histogram.LATENCY_BOUNDS) -> Histogram:
+        return self.__get_or_create(name, help, "histogram", labels, lambda rendered_labels: Histogram(rendered_labels, bounds))
+
+    def remove(self, labels: Dict[str, str]):
+        # removes the metrics which contain all the given labels, e.g. of a removed lane
+        selectors = [key + '="' + str(value) + '"' for key, value in labels.items()]
+        with self.__lock:
+            for family in self.__families.values():
+                for rendered_labels in [rendered_labels for rendered_labels in family.metrics.keys() if all(selector in rendered_labels for selector in selectors)]:
+                    del family.metrics[rendered_labels]
+
+    def render(self) -> str:
+        with self.__lock:
+            families = [(family, list(family.metrics.values())) for family in self.__families.values()]
+        lines = []
+        for family, metrics in families:
+            lines.append("# HELP " + family.name + " " + family.help)
+            lines.append("# TYPE " + family.name + " " + family.type)
+            for metric in metrics:
+                try:
+                    lines.extend(metric.render(family.name))
+                except Exception:
+                    pass   # e.g. a gauge of a terminated lane
+        return "\n".join(lines) + "\n"
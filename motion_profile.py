@@ -0,0 +1,95 @@
+from bisect import bisect_right
+from typing import List, Tuple
+from speed_profile import SpeedProfile
+
+
+class DutyPlan:
+    # the duty cycle segments (elapsed_ns, progress_ns, duty) of a movement. The progress is measured as travel time at full speed,
+    # so that the slots are counted by the speed profile
+    __slots__ = ('segments', 'travel_ns', 'progress_travel_ns', '__starts')
+
+    def __init__(self, segments: List[Tuple[int, int, float]], travel_ns: int, progress_travel_ns: int):
+        self.segments = segments
+        self.travel_ns = travel_ns
+        self.progress_travel_ns = progress_travel_ns
+        self.__starts = [elapsed_ns for elapsed_ns, _, _ in segments]
+
+    def __segment(self, elapsed_ns: int) -> Tuple[int, int, float]:
+        return self.segments[max(0, bisect_right(self.__starts, elapsed_ns) - 1)]
+
+    def progress_ns(self, elapsed_ns: int) -> int:
+        if elapsed_ns <= 0:
+            return 0
+        if elapsed_ns >= self.travel_ns:
+            return self.progress_travel_ns
+        start_ns, progress_ns, duty = self.__segment(elapsed_ns)
+        return min(self.progress_travel_ns, progress_ns + int((elapsed_ns - start_ns) * duty))
+
+    def duty_at(self, elapsed_ns: int) -> float:
+        return self.__segment(elapsed_ns)[2]
+
+    def next_change_ns(self, elapsed_ns: int) -> int:
+        # the elapsed time of the next duty change or the end of the travel
+        index = bisect_right(self.__starts, max(0, elapsed_ns))
+        return self.__starts[index] if index < len(self.__starts) else self.travel_ns
+
+
+class MotionProfile:
+    # soft start with a stepped duty ramp, cruise at full speed, a mirrored ramp down and a slow approach over the last slots.
+    # The slow approach reduces the coasting after the stop, so that a tighter slot tolerance can be used. As the ramps are
+    # symmetric, the slots lost by accelerating are regained by decelerating, whatever the inertia of the awning is
+
+    def __init__(self, ramp_sec: float = 0.5, ramp_steps: int = 5, start_duty: float = 0.3, approach_slots: int = 2, approach_duty: float = 0.3, slot_tolerance: int = 2):
+        if not (0 < start_duty <= 1 and 0 < approach_duty <= 1):
+            raise ValueError("duty cycles have to be within (0, 1]")
+        self.ramp_sec = ramp_sec
+        self.ramp_steps = ramp_steps
+        self.start_duty = start_duty
+        self.approach_slots = approach_slots
+        self.approach_duty = approach_duty
+        self.slot_tolerance = slot_tolerance
+
+    @staticmethod
+    def full(slot_tolerance: int = 7):
+        # on/off control without pwm pin
+        return MotionProfile(ramp_sec=0, ramp_steps=0, start_duty=1, approach_slots=0, approach_duty=1, slot_tolerance=slot_tolerance)
+
+    def plan(self, speed_profile: SpeedProfile, start_pos: int, num_slots: int, direction: int, running_duty: float = 0) -> DutyPlan:
+        # running_duty is the duty of a motor which already runs in the same direction. The ramp continues from there
+        progress_travel_ns = speed_profile.travel_ns(start_pos, num_slots, direction)
+        approach_slots = min(self.approach_slots, num_slots)
+        cruise_ns = speed_profile.travel_ns(start_pos, num_slots - approach_slots, direction)
+        step_ns = int(self.ramp_sec * 1_000_000_000 / self.ramp_steps) if self.ramp_steps > 0 else 0
+        # phases of (progress_ns, duty). Short moves do not reach full speed
+        ramp_up = []
+        peak_duty = 1.0
+        for step in range(self.ramp_steps):
+            duty = self.start_duty + ((1 - self.start_duty) * step / self.ramp_steps)
+            if duty < running_duty:
+                continue
+            if (sum([progress_ns for progress_ns, _ in ramp_up]) + int(step_ns * duty)) * 2 > cruise_ns:
+                peak_duty = duty
+                break
+            ramp_up.append((int(step_ns * duty), duty))
+        ramp_down = []
+        for step in range(1, self.ramp_steps):
+            duty = 1 - ((1 - self.approach_duty) * step / self.ramp_steps)
+            if duty < peak_duty:
+                ramp_down.append((int(step_ns * duty), duty))
+        while len(ramp_down) > 0 and sum([progress_ns for progress_ns, _ in ramp_up + ramp_down]) > cruise_ns:
+            ramp_down.pop(0)
+        peak_ns = cruise_ns - sum([progress_ns for progress_ns, _ in ramp_up + ramp_down])
+        phases = ramp_up + [(peak_ns, peak_duty)] + ramp_down + [(progress_travel_ns - cruise_ns, self.approach_duty)]
+
+        segments = []
+        elapsed_ns = 0
+        progress_ns = 0
+        for phase_ns, duty in phases:
+            if phase_ns > 0 or len(segments) == 0:
+                segments.append((elapsed_ns, progress_ns, duty))
+                elapsed_ns += int(phase_ns / duty)
+                progress_ns += phase_ns
+        return DutyPlan(segments, elapsed_ns, progress_travel_ns)
+
+
+FULL_SPEED = MotionProfile.full()
@@ -1,36 +1,84 @@
-import RPi.GPIO as GPIO
 from awning import Motor
+from gpio_backend import GPIOBackend, SimulatedGPIO, create_backend, BACKEND_RPI
+from speed_profile import SpeedProfile, load_speed_profiles
+from motion_profile import MotionProfile, FULL_SPEED
+from trace_recorder import Tracer, TraceEvent
 from dataclasses import dataclass
-from typing import List
+from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock
 import logging
 from os import path
 
 
-@dataclass
+@dataclass(frozen=True)
 class Config:
     name: str
     gpio_forward: int
     gpio_backward: int
+    step_duration: float
+    start_latency: float = 0
+    gpio_pwm: int = 0
 
 
-def load_tb6612fng(filename: str) -> List[Motor]:
-    logging.info("loading config " + filename)
-    motors = list()
+def load_gpio_backend(filename: str) -> GPIOBackend:
+    # the backend is selected by a setting line of the config file, e.g. backend = simulated
+    backend = BACKEND_RPI
+    if path.exists(filename):
+        with open(filename, "r") as file:
+            for line in file.readlines():
+                line = line.strip()
+                if not line.startswith("#") and "=" in line:
+                    key, value = [part.strip() for part in line.split("=", 1)]
+                    if key.lower() == "backend":
+                        backend = value
+    logging.info("using gpio backend " + backend)
+    return create_backend(backend)
+
+
+def load_tb6612fng_configs(filename: str) -> List[Config]:
+    configs = list()
     if "tb6612fng" in filename.lower() and path.exists(filename):
         with open(filename, "r") as file:
             for line in file.readlines():
                 line = line.strip()
-                if not line.startswith("#") and len(line) > 0:
+                if not line.startswith("#") and len(line) > 0 and "=" not in line:
                     try:
                         parts = line.split(",")
-                        name = parts[0].strip()
-                        pin_forward = int(parts[1].strip())
-                        pin_backward = int(parts[2].strip())
-                        step_duration = float(parts[3].strip())
-                        logging.info("config entry found: " + name + " with pin_forward=" + str(pin_forward) + ", pin_backward=" + str(pin_backward) + ", step_duration=" + str(step_duration) + ". Activate motor control")
-                        motors.append(TB6612FNGMotor(name, pin_forward, pin_backward, step_duration))
+                        configs.append(Config(parts[0].strip(), int(parts[1].strip()), int(parts[2].strip()), float(parts[3].strip()),
+                                              float(parts[4].strip()) if len(parts) > 4 else 0, int(parts[5].strip()) if len(parts) > 5 else 0))
                     except Exception as e:
                         logging.error("invalid syntax in line " + line + "  ignoring it" + str(e))
+    return configs
+
+
+def create_tb6612fng(config: Config, gpio: GPIOBackend, speed_profiles: Dict[str, SpeedProfile] = None, tracer: Tracer = None) -> Motor:
+    logging.info("config entry found: " + config.name + " with pin_forward=" + str(config.gpio_forward) + ", pin_backward=" + str(config.gpio_backward) +
+                 ", step_duration=" + str(config.step_duration) + ", start_latency=" + str(config.start_latency) + ", pin_pwm=" + str(config.gpio_pwm) + ". Activate motor control")
+    if isinstance(gpio, SimulatedGPIO):
+        gpio.add_awning(config.name, config.gpio_forward, config.gpio_backward, config.step_duration, pin_pwm=config.gpio_pwm)
+    speed_profile = None if speed_profiles is None else speed_profiles.get(config.name, None)
+    return TB6612FNGMotor(config.name, config.gpio_forward, config.gpio_backward, config.step_duration, config.start_latency, speed_profile, gpio, tracer, config.gpio_pwm)
+
+
+def load_tb6612fng(filename: str, gpio: GPIOBackend = None, tracer: Tracer = None) -> List[Motor]:
+    logging.info("loading config " + filename)
+    if gpio is None:
+        gpio = load_gpio_backend(filename)
+    # the optional speed profiles are stored alongside the config file, e.g. tb6612fng_motors.speed
+    speed_profiles = load_speed_profiles(path.splitext(filename)[0] + ".speed")
+
+    def create(config: Config) -> Optional[Motor]:
+        try:
+            return create_tb6612fng(config, gpio, speed_profiles, tracer)
+        except Exception as e:
+            logging.error("could not create motor " + config.name + "  ignoring it " + str(e))
+            return None
+
+    # the motors are initialized concurrently. The pin setup of a backend may take some msec per pin
+    configs = load_tb6612fng_configs(filename)
+    with ThreadPoolExecutor(max_workers=max(1, len(configs)), thread_name_prefix="motor_init") as executor:
+        motors = [motor for motor in executor.map(create, configs) if motor is not None]
     return motors
 
 
@@ -38,22 +86,43 @@ def load_tb6612fng(filename: str) -> List[Motor]:
 
 class TB6612FNGMotor(Motor):
 
-    def __init__(self, name: str, pin_forward: int, pin_backward: int, sec_per_step: float):
+    def __init__(self, name: str, pin_forward: int, pin_backward: int, sec_per_step: float, start_latency_sec: float = 0, speed_profile: SpeedProfile = None, gpio: GPIOBackend = None, tracer: Tracer = None,
+                 pin_pwm: int = 0, motion_profile: MotionProfile = None):
         self.__name = name
+        self.gpio = create_backend() if gpio is None else gpio
+        self.__trace = (Tracer.default() if tracer is None else tracer).recorder(name)
         self.__sec_per_step = sec_per_step
-        GPIO.setmode(GPIO.BCM)
+        self.__start_latency_sec = start_latency_sec
+        self.__speed_profile = SpeedProfile.constant(sec_per_step) if speed_profile is None else speed_profile
+        # the pins are switched by the scheduler thread and by the emergency retract
+        self.__lock = RLock()
         self.pin_forward = pin_forward
         self.pin_forward_is_on = False
         logging.info(self.__name + " register pin " + str(pin_forward) + " as forward")
-        GPIO.setup(pin_forward, GPIO.OUT, initial=0)
+        self.gpio.setup_output(pin_forward, 0)
         self.pin_backward = pin_backward
         self.pin_backward_is_on = False
         logging.info(self.__name + " register pin " + str(pin_backward) + " as backward")
-        GPIO.setup(pin_backward, GPIO.OUT, initial=0)
+        self.gpio.setup_output(pin_backward, 0)
+        # without pwm pin, the PWM input of the TB6612FNG is wired to high and the motor runs at full speed
+        self.pin_pwm = pin_pwm
+        self.duty = 1.0
+        if pin_pwm > 0:
+            logging.info(self.__name + " register pin " + str(pin_pwm) + " as pwm")
+            self.gpio.setup_pwm(pin_pwm)
+            self.duty = 0.0
+            self.__motion_profile = MotionProfile() if motion_profile is None else motion_profile
+        else:
+            self.__motion_profile = FULL_SPEED
+
+    def terminate(self, kept_pins: List[int] = ()):
+        for pin in self.pins:
+            if pin not in kept_pins:
+                self.gpio.cleanup(pin)
 
-    def terminate(self):
-        GPIO.cleanup(self.pin_forward)
-        GPIO.cleanup(self.pin_backward)
+    @property
+    def pins(self) -> List[int]:
+        return [self.pin_forward, self.pin_backward] + ([self.pin_pwm] if self.pin_pwm > 0 else [])
 
     @property
     def name(self) -> str:
@@ -63,26 +132,55 @@ class TB6612FNGMotor(Motor):
     def sec_per_step(self) -> float:
         return self.__sec_per_step
 
+    @property
+    def start_latency_sec(self) -> float:
+        return self.__start_latency_sec
+
+    @property
+    def speed_profile(self) -> SpeedProfile:
+        return self.__speed_profile
+
+    @property
+    def motion_profile(self) -> MotionProfile:
+        return self.__motion_profile
+
+    def set_speed(self, duty: float):
+        with self.__lock:
+            if self.pin_pwm > 0 and duty != self.duty:
+                self.gpio.set_duty_cycle(self.pin_pwm, duty)
+                self.duty = duty
+                self.__trace.record(TraceEvent.PIN, self.pin_pwm, int(duty * 100))
+
+    def __output(self, pin: int, value: int):
+        self.gpio.output(pin, value)
+        self.__trace.record(TraceEvent.PIN, pin, value)
 
     def stop(self):
-        if self.pin_backward_is_on or self.pin_forward_is_on:
-            logging.info(self.__name + " stop motor (forward and backward)")
-        if self.pin_backward_is_on:
-            GPIO.output(self.pin_backward, 0)
-            self.pin_backward_is_on = False
-        if self.pin_forward_is_on:
-            GPIO.output(self.pin_forward, 0)
-            self.pin_forward_is_on = False
+        with self.__lock:
+            if self.pin_backward_is_on or self.pin_forward_is_on:
+                logging.info(self.__name + " stop motor (forward and backward)")
+            if self.pin_backward_is_on:
+                self.__output(self.pin_backward, 0)
+                self.pin_backward_is_on = False
+            if self.pin_forward_is_on:
+                self.__output(self.pin_forward, 0)
+                self.pin_forward_is_on = False
 
     def backward(self):
-        self.stop()
-        logging.info(self.__name + " start backward motor")
-        GPIO.output(self.pin_backward, 1)
-        self.pin_backward_is_on = True
+        with self.__lock:
+            if self.pin_backward_is_on:
+                return
+            self.stop()
+            logging.info(self.__name + " start backward motor")
+            self.__output(self.pin_backward, 1)
+            self.pin_backward_is_on = True
 
     def forward(self):
-        self.stop()
-        logging.info(self.__name + " start forward motor")
-        GPIO.output(self.pin_forward, 1)
-        self.pin_forward_is_on = True
+        with self.__lock:
+            if self.pin_forward_is_on:
+                return
+            self.stop()
+            logging.info(self.__name + " start forward motor")
+            self.__output(self.pin_forward, 1)
+            self.pin_forward_is_on = True
 
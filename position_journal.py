@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass, asdict
+from threading import Thread, Lock, Event
+from typing import Dict, Optional
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    name: str
+    position: int
+    target: int
+    is_moving: bool
+    time: float
+    is_calibrated: bool = True
+    slots_driven: int = 0
+    reversals: int = 0
+    lost_slots: float = 0
+
+
+class PositionJournal:
+    COMPACT_SIZE_BYTES = 64 * 1024
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.__lock = Lock()
+        self.__entries = self.__load()
+        self.__queue = deque()
+        self.__queued = Event()
+        self.__is_closed = False
+        self.__compact()
+        self.__writer = Thread(name="position_journal", target=self.__write_loop, daemon=True)
+        self.__writer.start()
+
+    def __load(self) -> Dict[str, JournalEntry]:
+        entries = dict()
+        if os.path.exists(self.filename):
+            with open(self.filename, "r") as file:
+                for line in file.readlines():
+                    try:
+                        entry = JournalEntry(**json.loads(line))
+                        entries[entry.name] = entry
+                    except Exception as e:
+                        # e.g. a torn last line written on power loss
+                        logging.warning("ignoring invalid journal line " + line.strip() + " " + str(e))
+        return entries
+
+    def __compact(self):
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as file:
+            for entry in self.__entries.values():
+                file.write(json.dumps(asdict(entry)) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, self.filename)
+
+    def get(self, name: str) -> Optional[JournalEntry]:
+        with self.__lock:
+            return self.__entries.get(name, None)
+
+    def close(self):
+        # writes the queued entries. Later records are ignored
+        self.__is_closed = True
+        self.__queued.set()
+        self.__writer.join(timeout=5)
+
+    def record(self, name: str, position: int, target: int, is_moving: bool, is_calibrated: bool = True, slots_driven: int = 0, reversals: int = 0, lost_slots: float = 0):
+        if self.__is_closed:
+            return
+        entry = JournalEntry(name, position, target, is_moving, time.time(), is_calibrated, slots_driven, reversals, lost_slots)
+        with self.__lock:
+            self.__entries[name] = entry
+        # written by the journal thread to keep fsync latency off the motion path
+        self.__queue.append(entry)
+        self.__queued.set()
+
+    def __write_loop(self):
+        while not self.__is_closed or len(self.__queue) > 0:
+            self.__queued.wait()
+            self.__queued.clear()
+            try:
+                with open(self.filename, "a") as file:
+                    while len(self.__queue) > 0:
+                        file.write(json.dumps(asdict(self.__queue.popleft())) + "\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+                if os.path.getsize(self.filename) > self.COMPACT_SIZE_BYTES:
+                    with self.__lock:
+                        self.__compact()
+            except Exception as e:
+                logging.warning("error occurred on writing journal " + self.filename + " " + str(e))
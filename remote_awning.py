@@ -0,0 +1,283 @@
+import json
+import time
+import logging
+import http.client
+from os import path
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread, Lock, BoundedSemaphore
+from typing import List, Dict, Any, Tuple
+from awning import Awning, AwningState, MotionPlan, MoveOutcome, NotificationHub
+
+
+class ConnectionPool:
+    # keep-alive connections to the http api of another awning controller
+
+    def __init__(self, host: str, port: int, size: int = 4, timeout_sec: float = 10):
+        self.host = host
+        self.port = port
+        self.timeout_sec = timeout_sec
+        self.__slots = BoundedSemaphore(size)
+        self.__idle = deque()
+
+    def request(self, method: str, url: str, body: Dict[str, Any] = None) -> Tuple[int, Dict[str, Any]]:
+        with self.__slots:
+            is_reused = len(self.__idle) > 0
+            connection = self.__idle.pop() if is_reused else http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_sec)
+            while True:
+                try:
+                    if body is None:
+                        connection.request(method, url)
+                    else:
+                        connection.request(method, url, json.dumps(body), {"Content-Type": "application/json"})
+                    response = connection.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError) as e:
+                    connection.close()
+                    if not is_reused:
+                        raise e
+                    # the idle connection has been closed by the server in the meantime
+                    is_reused = False
+                    connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_sec)
+                except Exception as e:
+                    connection.close()
+                    raise e
+            if response.will_close:
+                connection.close()
+            else:
+                self.__idle.append(connection)
+            is_json = response.getheader("Content-Type", "").startswith("application/json")
+            return response.status, json.loads(data) if is_json else {}
+
+    def close(self):
+        while len(self.__idle) > 0:
+            self.__idle.pop().close()
+
+
+class RemoteAwning(Awning):
+    # an awning of another controller. The state is a snapshot updated by the event stream of the controller, so reading it never blocks
+
+    def __init__(self, name: str, controller, hub: NotificationHub = None):
+        super().__init__(name, hub)
+        self.__controller = controller
+        self.__values = {'position': 0, 'current_position': 0, 'is_target_reached': True, 'is_moving_forward': False, 'is_moving_backward': False}
+        self.__state = AwningState(**self.__values)
+        self.__motion_plan = MotionPlan(0, 0, 0, 0, 0)
+        self.__lock = Lock()
+        # (future, target position, is confirmed by the event stream) of the moves awaited until reached
+        self.__waiters: List[Tuple[Future, int, bool]] = []
+
+    def on_change(self, change: Dict[str, Any]):
+        # called by the event stream thread with the changed values or the full state
+        self.__update(change, True)
+
+    def on_target_applied(self, position: int):
+        # called by a command worker. The applied target is known before the event of the remote controller is received
+        self.__update({'position': position}, False)
+
+    def __update(self, change: Dict[str, Any], is_event: bool):
+        with self.__lock:
+            values = {**self.__values, **{key: value for key, value in change.items() if key in self.__values}}
+            self.__values = values
+            self.__state = AwningState(**values)
+            if 'motion_plan' in change:
+                self.__motion_plan = MotionPlan(**change['motion_plan'])
+            resolved = []
+            if is_event:
+                waiters = self.__waiters
+                self.__waiters = []
+                for future, target, is_confirmed in waiters:
+                    outcome = self.__outcome(target, is_confirmed)
+                    if outcome is None:
+                        self.__waiters.append((future, target, is_confirmed or self.__state.position == target))
+                    else:
+                        resolved.append((future, outcome))
+        for future, outcome in resolved:
+            future.set_result(outcome)
+        self._notify_listeners()
+
+    def __outcome(self, target: int, is_confirmed: bool):
+        state = self.__state
+        if state.position == target and state.current_position == target and state.is_target_reached:
+            return MoveOutcome.REACHED
+        # an event sent before the command has been applied still shows the former target
+        if is_confirmed and state.position != target:
+            return MoveOutcome.SUPERSEDED
+        return None
+
+    def __await_target(self, outcome_future: Future, applied: Future):
+        # called by the command worker. The move is awaited by watching the event stream, so no connection or worker is held
+        if applied.exception() is not None:
+            outcome_future.set_exception(applied.exception())
+            return
+        target = applied.result()
+        with self.__lock:
+            outcome = MoveOutcome.REACHED if self.__outcome(target, False) == MoveOutcome.REACHED else None
+            if outcome is None:
+                self.__waiters.append((outcome_future, target, False))
+        if outcome is not None:
+            outcome_future.set_result(outcome)
+
+    def cancel_waiters(self, reason: str):
+        with self.__lock:
+            waiters = self.__waiters
+            self.__waiters = []
+        for future, _, _ in waiters:
+            future.set_exception(ValueError(self.name + " " + reason))
+
+    def get_state(self) -> AwningState:
+        return self.__state
+
+    def get_motion_plan(self) -> MotionPlan:
+        return self.__motion_plan
+
+    def is_target_reached(self) -> bool:
+        return self.__state.is_target_reached
+
+    def get_position(self) -> int:
+        return self.__state.position
+
+    def is_moving_forward(self) -> bool:
+        return self.__state.is_moving_forward
+
+    def is_moving_backward(self) -> bool:
+        return self.__state.is_moving_backward
+
+    def eta_seconds(self) -> float:
+        # the motion plan is based on the (ntp synchronized) clock of the remote controller
+        if self.__state.is_target_reached:
+            return 0
+        return max(0.0, self.__motion_plan.end_time - time.time())
+
+    def set_position(self, new_position: int, until_reached: bool = False) -> Future:
+        logging.info(self.name + " set position: " + str(new_position))
+        if self.__controller.is_locked_out and new_position > 0:
+            # also if the forwarded lockout did not reach the remote controller
+            future = Future()
+            future.set_exception(ValueError(self.name + " is locked by the emergency retract"))
+            return future
+        applied = self.__controller.submit(self.name, "position=" + str(int(new_position)), 'target_position')
+        if until_reached:
+            outcome_future = Future()
+            applied.add_done_callback(lambda _: self.__await_target(outcome_future, applied))
+            return outcome_future
+        return applied
+
+    def stop(self) -> Future:
+        return self.__controller.submit(self.name, "stop=true", 'target_position', is_urgent=True)
+
+
+class RemoteController:
+    # the awnings of another controller, e.g. RemoteController("192.168.0.24:9501", ["lane5", "lane6"])
+
+    def __init__(self, address: str, names: List[str], pool_size: int = 4, hub: NotificationHub = None):
+        host, port = address.rsplit(":", 1) if ":" in address else (address, "9501")
+        self.address = host + ":" + port
+        self.__pool = ConnectionPool(host, int(port), pool_size)
+        self.__executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="remote_awning")
+        # stops and emergency commands never queue behind the commands of a slow or unresponsive connection
+        self.__urgent_pool = ConnectionPool(host, int(port), 1)
+        self.__urgent_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="remote_awning_urgent")
+        self.__is_closed = False
+        self.awnings: Dict[str, RemoteAwning] = {name: RemoteAwning(name, self, hub) for name in names}
+        self.is_connected = False
+        self.is_locked_out = False
+
+    def get_awnings(self) -> List[RemoteAwning]:
+        return list(self.awnings.values())
+
+    def start(self):
+        Thread(name="remote_awning_events", target=self.__receive_events, daemon=True).start()
+
+    def close(self):
+        self.__is_closed = True
+        self.__executor.shutdown(wait=False)
+        self.__urgent_executor.shutdown(wait=False)
+        self.__pool.close()
+        self.__urgent_pool.close()
+        for awning in self.awnings.values():
+            awning.cancel_waiters("is closed")
+
+    def submit(self, name: str, query: str, result_key: str, is_urgent: bool = False) -> Future:
+        # the command is sent by a worker. The caller is never blocked by the network
+        if is_urgent:
+            return self.__urgent_executor.submit(self.__command, self.__urgent_pool, name, query, result_key)
+        return self.__executor.submit(self.__command, self.__pool, name, query, result_key)
+
+    def emergency(self, action: str) -> Future:
+        # forwards the emergency retract (action=retract) or the clearing of the lockout (action=clear) of the local controller
+        self.is_locked_out = action == "retract"
+        return self.__urgent_executor.submit(self.__emergency, action)
+
+    def __emergency(self, action: str) -> Dict[str, Any]:
+        status, data = self.__urgent_pool.request("GET", "/_emergency?action=" + action)
+        if status != 200:
+            raise ValueError(self.address + " rejected emergency " + action + ": " + str(data.get("error", status)))
+        return data
+
+    def __command(self, pool: ConnectionPool, name: str, query: str, result_key: str):
+        status, data = pool.request("GET", "/" + name + "?" + query)
+        if status != 200 or result_key not in data:
+            raise ValueError(self.address + " rejected " + name + "?" + query + ": " + str(data.get("error", status)))
+        if result_key == 'target_position':
+            self.awnings[name].on_target_applied(data[result_key])
+        return data[result_key]
+
+    def __receive_events(self):
+        wait_sec = 1
+        while not self.__is_closed:
+            try:
+                self.__stream_events()
+                wait_sec = 1
+            except Exception as e:
+                logging.warning("event stream of " + self.address + " interrupted " + str(e) + ". Reconnecting in " + str(wait_sec) + " sec")
+            self.is_connected = False
+            time.sleep(wait_sec)
+            wait_sec = min(wait_sec * 2, 30)
+
+    def __stream_events(self):
+        # server-sent events of /_events. A new subscription starts with the full state, so no change is missed after a reconnect
+        connection = http.client.HTTPConnection(self.__pool.host, self.__pool.port, timeout=60)
+        try:
+            connection.request("GET", "/_events")
+            response = connection.getresponse()
+            if response.status != 200:
+                raise ValueError("got status " + str(response.status))
+            self.is_connected = True
+            logging.info("receiving events of " + self.address)
+            data = []
+            while not self.__is_closed:
+                line = response.readline()
+                if len(line) == 0:
+                    return
+                line = line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif len(line) == 0 and len(data) > 0:
+                    change = json.loads("\n".join(data))
+                    data = []
+                    awning = self.awnings.get(change.get('name', None), None)
+                    if awning is not None:
+                        awning.on_change(change)
+        finally:
+            connection.close()
+
+
+def load_remote_controllers(filename: str) -> List[RemoteController]:
+    # remote awnings are defined by setting lines of the config file, e.g. remote = 192.168.0.24:9501, lane5, lane6
+    controllers = list()
+    if path.exists(filename):
+        with open(filename, "r") as file:
+            for line in file.readlines():
+                line = line.strip()
+                if not line.startswith("#") and "=" in line:
+                    key, value = [part.strip() for part in line.split("=", 1)]
+                    if key.lower() == "remote":
+                        parts = [part.strip() for part in value.split(",") if len(part.strip()) > 0]
+                        if len(parts) < 2:
+                            logging.error("invalid syntax in line " + line + "  ignoring it")
+                            continue
+                        logging.info("remote awnings " + ", ".join(parts[1:]) + " of " + parts[0])
+                        controllers.append(RemoteController(parts[0], parts[1:]))
+    return controllers
@@ -0,0 +1,131 @@
+import sys
+import logging
+from bisect import bisect_right, bisect_left
+from os import path
+from typing import List, Dict, Tuple
+
+
+class SpeedProfile:
+    NUM_SEGMENTS = 10
+    FORWARD = "forward"
+    BACKWARD = "backward"
+
+    def __init__(self, forward_sec_per_slot: List[float], backward_sec_per_slot: List[float]):
+        if len(forward_sec_per_slot) != self.NUM_SEGMENTS or len(backward_sec_per_slot) != self.NUM_SEGMENTS:
+            raise ValueError("speed profile requires " + str(self.NUM_SEGMENTS) + " segments per direction")
+        self.forward_sec_per_slot = forward_sec_per_slot
+        self.backward_sec_per_slot = backward_sec_per_slot
+        # cumulative travel time from position 0 to position p (index p) per direction
+        self.__forward_ns = self.__cumulate(forward_sec_per_slot)
+        self.__backward_ns = self.__cumulate(backward_sec_per_slot)
+
+    @staticmethod
+    def constant(sec_per_slot: float):
+        return SpeedProfile([sec_per_slot] * SpeedProfile.NUM_SEGMENTS, [sec_per_slot] * SpeedProfile.NUM_SEGMENTS)
+
+    def __cumulate(self, sec_per_slot: List[float]) -> List[int]:
+        # slot p covers the travel between position p and p + 1
+        times_ns = [0]
+        for position in range(0, 100):
+            times_ns.append(times_ns[-1] + int(sec_per_slot[self.__segment(position)] * 1_000_000_000))
+        return times_ns
+
+    def __segment(self, position: int) -> int:
+        return min(max(position, 0) * self.NUM_SEGMENTS // 100, self.NUM_SEGMENTS - 1)
+
+    def travel_ns(self, start_pos: int, num_slots: int, direction: int) -> int:
+        if direction > 0:
+            return self.__forward_ns[start_pos + num_slots] - self.__forward_ns[start_pos]
+        else:
+            return self.__backward_ns[start_pos] - self.__backward_ns[start_pos - num_slots]
+
+    def num_slots_after(self, start_pos: int, direction: int, elapsed_ns: int) -> Tuple[int, float]:
+        # returns the completed slots and the completed fraction of the current slot
+        if elapsed_ns <= 0:
+            return 0, 0
+        if direction > 0:
+            times_ns = self.__forward_ns
+            reached_ns = times_ns[start_pos] + elapsed_ns
+            position = min(bisect_right(times_ns, reached_ns) - 1, 100)
+            if position >= 100:
+                return position - start_pos, 0
+            fraction = (reached_ns - times_ns[position]) / (times_ns[position + 1] - times_ns[position])
+            return position - start_pos, fraction
+        else:
+            times_ns = self.__backward_ns
+            reached_ns = times_ns[start_pos] - elapsed_ns
+            position = max(bisect_left(times_ns, reached_ns), 0)
+            if position <= 0:
+                return start_pos, 0
+            fraction = (times_ns[position] - reached_ns) / (times_ns[position] - times_ns[position - 1])
+            return start_pos - position, fraction
+
+    @staticmethod
+    def fit(sec_per_slot: float, runs: List[Tuple[int, int, float]], num_iterations: int = 200) -> List[float]:
+        # fits the sec per slot of each segment to timed runs (start position, end position, duration in sec) of one direction.
+        # Starts with the given sec per slot and projects the estimate onto each run equation (Kaczmarz method)
+        estimate = [sec_per_slot] * SpeedProfile.NUM_SEGMENTS
+        rows = []
+        for start_pos, end_pos, duration_sec in runs:
+            low, high = min(start_pos, end_pos), max(start_pos, end_pos)
+            row = [0] * SpeedProfile.NUM_SEGMENTS
+            for position in range(low, high):
+                row[min(position * SpeedProfile.NUM_SEGMENTS // 100, SpeedProfile.NUM_SEGMENTS - 1)] += 1
+            if high > low:
+                rows.append((row, duration_sec))
+        for _ in range(num_iterations):
+            for row, duration_sec in rows:
+                error = duration_sec - sum(slots * sec for slots, sec in zip(row, estimate))
+                norm = sum(slots * slots for slots in row)
+                estimate = [max(0.001, sec + (error * slots / norm)) for slots, sec in zip(row, estimate)]
+        return estimate
+
+
+def load_speed_profiles(filename: str) -> Dict[str, SpeedProfile]:
+    profiles = dict()
+    tables = dict()
+    if path.exists(filename):
+        with open(filename, "r") as file:
+            for line in file.readlines():
+                line = line.strip()
+                if not line.startswith("#") and len(line) > 0:
+                    try:
+                        parts = [part.strip() for part in line.split(",")]
+                        tables.setdefault(parts[0], dict())[parts[1]] = [float(part) for part in parts[2:]]
+                    except Exception as e:
+                        logging.error("invalid syntax in line " + line + "  ignoring it" + str(e))
+    for name, table in tables.items():
+        try:
+            profiles[name] = SpeedProfile(table[SpeedProfile.FORWARD], table[SpeedProfile.BACKWARD])
+            logging.info("speed profile loaded for " + name)
+        except Exception as e:
+            logging.error("invalid speed profile for " + name + " ignoring it " + str(e))
+    return profiles
+
+
+def save_speed_profiles(filename: str, profiles: Dict[str, SpeedProfile]):
+    with open(filename, "w") as file:
+        file.write("# name, direction, sec_per_slot for each 10% segment of the travel\n")
+        for name, profile in profiles.items():
+            file.write(name + ", " + SpeedProfile.FORWARD + ", " + ", ".join([str(round(sec, 4)) for sec in profile.forward_sec_per_slot]) + "\n")
+            file.write(name + ", " + SpeedProfile.BACKWARD + ", " + ", ".join([str(round(sec, 4)) for sec in profile.backward_sec_per_slot]) + "\n")
+
+
+if __name__ == '__main__':
+    # fits the speed profile of a lane from timed runs, e.g.
+    # python speed_profile.py /etc/awning/tb6612fng_motors.speed lane1 0.5 forward 0:100:52.3 0:50:24.1 backward 100:0:46.8
+    logging.basicConfig(level=logging.INFO)
+    filename, name, default_sec_per_slot = sys.argv[1], sys.argv[2], float(sys.argv[3])
+    runs = {SpeedProfile.FORWARD: [], SpeedProfile.BACKWARD: []}
+    direction = SpeedProfile.FORWARD
+    for arg in sys.argv[4:]:
+        if arg in runs.keys():
+            direction = arg
+        else:
+            start_pos, end_pos, duration_sec = arg.split(":")
+            runs[direction].append((int(start_pos), int(end_pos), float(duration_sec)))
+    profiles = load_speed_profiles(filename)
+    profiles[name] = SpeedProfile(SpeedProfile.fit(default_sec_per_slot, runs[SpeedProfile.FORWARD]),
+                                  SpeedProfile.fit(default_sec_per_slot, runs[SpeedProfile.BACKWARD]))
+    save_speed_profiles(filename, profiles)
+    logging.info("speed profile of " + name + " saved to " + filename)
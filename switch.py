@@ -1,55 +1,158 @@
+import time
 import logging
-import RPi.GPIO as GPIO
-from datetime import datetime, timedelta
+from collections import deque
+from threading import Thread, Event
+from typing import Dict, Optional
 from awning import Awnings
+from gpio_backend import GPIOBackend, create_backend
+from metrics import Metrics
+from trace_recorder import Tracer, TraceEvent
+
+
+class Gesture:
+    PRESS = "press"
+    DOUBLE_PRESS = "double_press"
+    LONG_PRESS = "long_press"
+    LONG_PRESS_RELEASE = "long_press_release"
+
+
+class Button:
+    # the debounced state and the gesture state of a switch pin
+
+    def __init__(self, pin: int, direction: int):
+        self.pin = pin
+        self.direction = direction
+        self.last_edge_ns = 0
+        self.first_edge_ns: Optional[int] = None   # the first edge of the current bounce burst
+        self.level = 0
+        self.pressed_ns = 0
+        self.released_ns = 0
+        self.was_short_press = False
+        self.is_long_press = False
 
 
 class Switch:
-    STOP = (False, False)
-    MOVE_FORWARD = (True, False)
-    MOVE_BACKWARD = (False, True)
-    IDLE = (True, True)
+    DEBOUNCE_SEC = 0.01
+    DOUBLE_PRESS_SEC = 0.4
+    LONG_PRESS_SEC = 0.8
 
-    def __init__(self, pin_forward: int, pin_backward: int, awnings: Awnings):
+    def __init__(self, pin_forward: int, pin_backward: int, awnings: Awnings, gpio: GPIOBackend = None, tracer: Tracer = None, metrics: Metrics = None):
         self.awnings = awnings
+        self.__trace = (Tracer.default() if tracer is None else tracer).recorder(awnings.name)
+        metrics = Metrics.default() if metrics is None else metrics
+        self.__press_to_motor_sec = metrics.histogram("awning_switch_press_to_motor_seconds", "latency between the first switch edge and the applied motor command")
+        self.__gestures = {gesture: metrics.counter("awning_switch_gestures_total", "decoded switch gestures", {"gesture": gesture})
+                           for gesture in (Gesture.PRESS, Gesture.DOUBLE_PRESS, Gesture.LONG_PRESS, Gesture.LONG_PRESS_RELEASE)}
+        self.gpio = create_backend() if gpio is None else gpio
         self.pin_forward = pin_forward
         self.pin_backward = pin_backward
-        self.last_pressed = datetime.now()
-        self.state = self.IDLE
-        GPIO.setmode(GPIO.BCM)
+        self.buttons: Dict[int, Button] = {pin_forward: Button(pin_forward, 1), pin_backward: Button(pin_backward, -1)}
+        # edges are handed over to the worker by a deque. Appending is atomic and never blocks the gpio event thread
+        self.__edges = deque(maxlen=1024)
+        self.__edge_received = Event()
+        self.__is_terminated = False
         logging.info("Switch register pin " + str(self.pin_forward) + " as forward")
-        GPIO.setup(self.pin_forward, GPIO.IN, GPIO.PUD_DOWN)
-        GPIO.add_event_detect(self.pin_forward, GPIO.BOTH)
-        GPIO.add_event_callback(self.pin_forward, self.on_switch_updated)
+        self.gpio.setup_input(self.pin_forward)
+        self.gpio.add_edge_callback(self.pin_forward, self.on_switch_updated)
         logging.info("Switch register pin " + str(self.pin_backward) + " as backward")
-        GPIO.setup(self.pin_backward, GPIO.IN, GPIO.PUD_DOWN)
-        GPIO.add_event_detect(self.pin_backward, GPIO.BOTH)
-        GPIO.add_event_callback(self.pin_backward, self.on_switch_updated)
+        self.gpio.setup_input(self.pin_backward)
+        self.gpio.add_edge_callback(self.pin_backward, self.on_switch_updated)
+        Thread(name="switch", target=self.__process_edges, daemon=True).start()
         logging.info("Switch bound to pin_forward=" + str(self.pin_forward) + " and pin_backward=" + str(self.pin_backward))
 
 
     def terminate(self):
-        GPIO.cleanup(self.pin_forward)
-        GPIO.cleanup(self.pin_backward)
+        self.__is_terminated = True
+        self.__edge_received.set()
+        self.gpio.cleanup(self.pin_forward)
+        self.gpio.cleanup(self.pin_backward)
 
 
     def on_switch_updated(self, pin: int):
-        is_forward = GPIO.input(self.pin_forward) >= 1
-        is_backward = GPIO.input(self.pin_backward) >= 1
-        new_state = (is_forward, is_backward)
-
-        if datetime.now() > self.last_pressed + timedelta(milliseconds=200):
-            self.last_pressed = datetime.now()
-            try:
-                if new_state == self.MOVE_FORWARD:
-                    if self.awnings.is_moving_forward():
-                        self.awnings.stop()
-                    else:
-                        self.awnings.set_position(100)
-                elif new_state == self.MOVE_BACKWARD:
-                    if self.awnings.is_moving_backward():
-                        self.awnings.stop()
-                    else:
-                        self.awnings.set_position(0)
-            except Exception as e:
-                logging.error(e)
+        # called by the gpio event thread. Captures the edge only
+        level = self.gpio.input(pin)
+        self.__edges.append((pin, level, time.monotonic_ns()))
+        self.__edge_received.set()
+        self.__trace.record(TraceEvent.SWITCH, pin, level)
+
+    def __process_edges(self):
+        while not self.__is_terminated:
+            self.__edge_received.wait(self.__next_timeout_sec())
+            self.__edge_received.clear()
+            while len(self.__edges) > 0:
+                pin, level, edge_ns = self.__edges.popleft()
+                button = self.buttons.get(pin, None)
+                if button is not None:
+                    button.last_edge_ns = edge_ns
+                    if button.first_edge_ns is None:
+                        button.first_edge_ns = edge_ns
+            now_ns = time.monotonic_ns()
+            for button in self.buttons.values():
+                try:
+                    self.__debounce(button, now_ns)
+                    if button.level > 0 and not button.is_long_press and now_ns - button.pressed_ns >= self.LONG_PRESS_SEC * 1_000_000_000:
+                        button.is_long_press = True
+                        # the latency is measured from the first edge of the press, like the other gestures
+                        self.__on_gesture(button, Gesture.LONG_PRESS, button.pressed_ns)
+                except Exception as e:
+                    logging.error("error occurred on processing switch pin " + str(button.pin) + " " + str(e))
+
+    def __next_timeout_sec(self) -> Optional[float]:
+        now_ns = time.monotonic_ns()
+        deadlines_ns = []
+        for button in self.buttons.values():
+            if button.first_edge_ns is not None:
+                deadlines_ns.append(button.last_edge_ns + int(self.DEBOUNCE_SEC * 1_000_000_000))
+            if button.level > 0 and not button.is_long_press:
+                deadlines_ns.append(button.pressed_ns + int(self.LONG_PRESS_SEC * 1_000_000_000))
+        if len(deadlines_ns) == 0:
+            return None
+        return max(0, min(deadlines_ns) - now_ns) / 1_000_000_000
+
+    def __debounce(self, button: Button, now_ns: int):
+        # a level is accepted, if it has been stable for the debounce time
+        if button.first_edge_ns is None or now_ns - button.last_edge_ns < self.DEBOUNCE_SEC * 1_000_000_000:
+            return
+        first_edge_ns = button.first_edge_ns
+        button.first_edge_ns = None
+        level = 1 if self.gpio.input(button.pin) >= 1 else 0
+        if level == button.level:
+            return   # a glitch
+        button.level = level
+        if level > 0:
+            is_double_press = button.was_short_press and first_edge_ns - button.released_ns <= self.DOUBLE_PRESS_SEC * 1_000_000_000
+            button.pressed_ns = first_edge_ns
+            button.is_long_press = False
+            self.__on_gesture(button, Gesture.DOUBLE_PRESS if is_double_press else Gesture.PRESS, first_edge_ns)
+        else:
+            button.released_ns = first_edge_ns
+            button.was_short_press = not button.is_long_press
+            if button.is_long_press:
+                self.__on_gesture(button, Gesture.LONG_PRESS_RELEASE, first_edge_ns)
+
+    def __is_moving(self, direction: int) -> bool:
+        # the lanes are asked directly. The state of the group is updated with a delay
+        if direction > 0:
+            return any(awning.is_moving_forward() for awning in self.awnings.get_awnings())
+        else:
+            return any(awning.is_moving_backward() for awning in self.awnings.get_awnings())
+
+    def __on_gesture(self, button: Button, gesture: str, edge_ns: int):
+        self.__gestures[gesture].inc()
+        end_position = 100 if button.direction > 0 else 0
+        if gesture in (Gesture.PRESS, Gesture.DOUBLE_PRESS):
+            # a press toggles between moving to the end position and stopping
+            future = self.awnings.stop() if self.__is_moving(button.direction) else self.awnings.set_position(end_position)
+        elif gesture == Gesture.LONG_PRESS:
+            # the awnings keep moving while the switch is held
+            if self.__is_moving(button.direction):
+                return
+            future = self.awnings.set_position(end_position)
+        else:
+            future = self.awnings.stop()
+        future.add_done_callback(lambda _: self.__on_applied(gesture, edge_ns))
+
+    def __on_applied(self, gesture: str, edge_ns: int):
+        latency_sec = (time.monotonic_ns() - edge_ns) / 1_000_000_000
+        self.__press_to_motor_sec.observe(latency_sec)
+        logging.info("switch " + gesture + " applied " + str(round(latency_sec * 1000, 1)) + " ms after the first edge")
@@ -0,0 +1,116 @@
+import json
+import struct
+from array import array
+from itertools import count
+from threading import Lock
+from typing import List, Dict, Any, Iterator, Tuple
+from clock import Clock, SYSTEM_CLOCK
+
+
+class TraceEvent:
+    SET_POSITION = 1    # a = new position, b = 1 if until reached
+    STOP = 2
+    MOVEMENT = 3        # a = start position, b = target position
+    PIN = 4             # a = pin, b = value
+    SWITCH = 5          # a = pin, b = level
+    CALIBRATE = 6       # a = assumed start position
+    EMERGENCY = 7       # a = 1 if retracted, 0 if the lockout is cleared
+
+    NAMES = {SET_POSITION: "set_position", STOP: "stop", MOVEMENT: "movement", PIN: "pin", SWITCH: "switch", CALIBRATE: "calibrate", EMERGENCY: "emergency"}
+
+
+class TraceRecorder:
+    # fixed size ring buffer of the events of an awning. The oldest events are overwritten
+
+    def __init__(self, name: str, capacity: int = 4096, clock: Clock = SYSTEM_CLOCK):
+        self.name = name
+        self.capacity = capacity
+        self.clock = clock
+        # each writer claims its own slot by the atomic sequence. Recording requires no lock
+        self.__sequence = count()
+        self.__count = 0
+        # the columns are preallocated. Recording an event does not allocate
+        self.__times_ns = array('q', [0]) * capacity
+        self.__kinds = array('B', [0]) * capacity
+        self.__a = array('i', [0]) * capacity
+        self.__b = array('i', [0]) * capacity
+
+    def record(self, kind: int, a: int = 0, b: int = 0):
+        sequence = next(self.__sequence)
+        index = sequence % self.capacity
+        self.__times_ns[index] = self.clock.monotonic_ns()
+        self.__kinds[index] = kind
+        self.__a[index] = a
+        self.__b[index] = b
+        self.__count = sequence + 1
+
+    def events(self) -> List[Tuple[int, int, int, int]]:
+        # the recorded events (time_ns, kind, a, b) from the oldest to the newest
+        last = self.__count
+        first = max(0, last - self.capacity)
+        return [(self.__times_ns[i % self.capacity], self.__kinds[i % self.capacity], self.__a[i % self.capacity], self.__b[i % self.capacity]) for i in range(first, last)]
+
+
+class Tracer:
+    # registry of the trace recorders by awning name
+    __default = None
+    BINARY_MAGIC = b"AWTR1\n"
+    BINARY_RECORD = struct.Struct("<qBBhh")   # time_ns, lane index, kind, a, b
+
+    def __init__(self, capacity: int = 4096, clock: Clock = SYSTEM_CLOCK):
+        self.capacity = capacity
+        self.clock = clock
+        self.__lock = Lock()
+        self.__recorders: Dict[str, TraceRecorder] = dict()
+
+    @staticmethod
+    def default():
+        if Tracer.__default is None:
+            Tracer.__default = Tracer()
+        return Tracer.__default
+
+    def recorder(self, name: str) -> TraceRecorder:
+        with self.__lock:
+            recorder = self.__recorders.get(name, None)
+            if recorder is None:
+                recorder = TraceRecorder(name, self.capacity, self.clock)
+                self.__recorders[name] = recorder
+            return recorder
+
+    def remove(self, name: str):
+        # e.g. of a removed lane
+        with self.__lock:
+            self.__recorders.pop(name, None)
+
+    def __merged_events(self, names: List[str] = None) -> Tuple[List[str], List[Tuple[int, int, int, int, int]]]:
+        with self.__lock:
+            recorders = [recorder for recorder in self.__recorders.values() if names is None or recorder.name in names]
+        events = []
+        for index, recorder in enumerate(recorders):
+            events.extend([(time_ns, index, kind, a, b) for time_ns, kind, a, b in recorder.events()])
+        events.sort()
+        return [recorder.name for recorder in recorders], events
+
+    def dump_ndjson(self, names: List[str] = None) -> Iterator[str]:
+        lanes, events = self.__merged_events(names)
+        for time_ns, index, kind, a, b in events:
+            yield json.dumps({"t_ns": time_ns, "lane": lanes[index], "event": TraceEvent.NAMES.get(kind, str(kind)), "a": a, "b": b}) + "\n"
+
+    def dump_binary(self, names: List[str] = None) -> bytes:
+        lanes, events = self.__merged_events(names)
+        header = json.dumps({"lanes": lanes}).encode("utf-8") + b"\n"
+        return self.BINARY_MAGIC + header + b"".join([self.BINARY_RECORD.pack(time_ns, index, kind, max(-32768, min(32767, a)), max(-32768, min(32767, b)))
+                                                      for time_ns, index, kind, a, b in events])
+
+
+def load_trace(data: bytes) -> List[Dict[str, Any]]:
+    # parses a binary or ndjson dump into events of the form {"t_ns", "lane", "event", "a", "b"}
+    if data.startswith(Tracer.BINARY_MAGIC):
+        header_end = data.index(b"\n", len(Tracer.BINARY_MAGIC))
+        lanes = json.loads(data[len(Tracer.BINARY_MAGIC):header_end])["lanes"]
+        records = data[header_end + 1:]
+        size = Tracer.BINARY_RECORD.size
+        return [{"t_ns": time_ns, "lane": lanes[index], "event": TraceEvent.NAMES.get(kind, str(kind)), "a": a, "b": b}
+                for time_ns, index, kind, a, b in [Tracer.BINARY_RECORD.unpack_from(records, offset) for offset in range(0, len(records) - size + 1, size)]]
+    else:
+        return [json.loads(line) for line in data.decode("utf-8").splitlines() if len(line.strip()) > 0]
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import tempfile
+from typing import List, Dict, Any, Tuple
+from awning import PiAwning, MotionScheduler
+from clock import VirtualClock
+from gpio_backend import SimulatedGPIO
+from metrics import Metrics
+from motor_tb6612Fng import load_tb6612fng
+from position_journal import PositionJournal
+from trace_recorder import Tracer, load_trace
+
+
+def recorded_moves(events: List[Dict[str, Any]], lane: str, start_ns: int) -> List[Tuple[int, int, int]]:
+    # the motor runs (offset_ns, start position, target position) of a lane. Idle movements are ignored
+    return [(event["t_ns"] - start_ns, event["a"], event["b"]) for event in events
+            if event["lane"] == lane and event["event"] == "movement" and event["a"] != event["b"]]
+
+
+def replay(events: List[Dict[str, Any]], config_filename: str, tolerance_ms: float = 50) -> Dict[str, Any]:
+    # feeds the commands of a recorded trace into the simulated stack and compares the resulting motor runs with the recorded ones
+    start_ns = min([event["t_ns"] for event in events], default=0)
+    end_ns = max([event["t_ns"] for event in events], default=0) - start_ns
+    clock = VirtualClock()
+    scheduler = MotionScheduler("replay_motion_scheduler", clock, Metrics())
+    tracer = Tracer(capacity=max(4096, len(events) * 4), clock=clock)
+    gpio = SimulatedGPIO(clock.monotonic, clock.sleep)
+    with tempfile.TemporaryDirectory() as directory:
+        # the lanes start at the position of their first recorded movement
+        journal = PositionJournal(os.path.join(directory, "replay.journal"))
+        for event in reversed(events):
+            if event["event"] == "movement":
+                journal.record(event["lane"], event["a"], event["a"], False)
+        lanes = {motor.name: PiAwning(motor, scheduler=scheduler, journal=journal, metrics=Metrics(), tracer=tracer) for motor in load_tb6612fng(config_filename, gpio, tracer)}
+
+        def run_command(event: Dict[str, Any]):
+            lane = lanes[event["lane"]]
+            if event["event"] == "set_position":
+                lane.set_position(event["a"], until_reached=event["b"] > 0)
+            elif event["event"] == "stop":
+                lane.stop()
+            elif event["event"] == "calibrate":
+                lane.calibrate_async(start_pos=event["a"])
+            elif event["event"] == "emergency" and event["a"] > 0:
+                lane.emergency_retract()
+            elif event["event"] == "emergency":
+                lane.clear_lockout()
+
+        num_commands = 0
+        for event in events:
+            if event["lane"] in lanes and event["event"] in ("set_position", "stop", "calibrate", "emergency"):
+                scheduler.schedule(event["t_ns"] - start_ns, lambda event=event: run_command(event))
+                num_commands += 1
+        max_sec_per_slot = max([lane.sec_per_slot for lane in lanes.values()], default=0)
+        scheduler.run_until(end_ns + int((200 * max_sec_per_slot + 5) * 1_000_000_000))
+
+        replayed = list(tracer.dump_ndjson(list(lanes.keys())))
+        replayed_events = [json.loads(line) for line in replayed]
+        mismatches = []
+        num_moves = 0
+        for name in lanes.keys():
+            expected = recorded_moves(events, name, start_ns)
+            actual = recorded_moves(replayed_events, name, 0)
+            num_moves += len(expected)
+            for index in range(max(len(expected), len(actual))):
+                expected_move = expected[index] if index < len(expected) else None
+                actual_move = actual[index] if index < len(actual) else None
+                if expected_move is None or actual_move is None or expected_move[1:] != actual_move[1:] or abs(expected_move[0] - actual_move[0]) > tolerance_ms * 1_000_000:
+                    mismatches.append({"lane": name, "index": index,
+                                       "recorded": None if expected_move is None else {"offset_ms": expected_move[0] / 1_000_000, "start": expected_move[1], "target": expected_move[2]},
+                                       "replayed": None if actual_move is None else {"offset_ms": actual_move[0] / 1_000_000, "start": actual_move[1], "target": actual_move[2]}})
+        journal.close()
+        unknown_lanes = sorted(set([event["lane"] for event in events if event["event"] in ("set_position", "stop", "calibrate", "emergency")]) - set(lanes.keys()))
+    return {"commands": num_commands,
+            "recorded_moves": num_moves,
+            "mismatches": len(mismatches),
+            "first_mismatches": mismatches[:10],
+            "unknown_lanes": unknown_lanes,
+            "final_positions": {name: lane.get_current_position() for name, lane in lanes.items()},
+            "physical_positions": {name: round(awning.position, 2) for name, awning in gpio.awnings.items()}}
+
+
+if __name__ == '__main__':
+    # replays a trace dumped by http://<host>:9501/_trace (ndjson) or /_trace?format=binary, e.g.
+    # python trace_replay.py incident.trace /etc/awning/tb6612fng_motors.config
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description='replays a recorded awning trace on the simulated backend')
+    parser.add_argument('trace', help='the trace file')
+    parser.add_argument('config', help='the motor config file, e.g. tb6612fng_motors.config')
+    parser.add_argument('--tolerance', type=float, default=50, help='tolerated timing deviation of a motor run in msec')
+    args = parser.parse_args()
+    with open(args.trace, "rb") as file:
+        report = replay(load_trace(file.read()), args.config, args.tolerance)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["mismatches"] == 0 else 1)
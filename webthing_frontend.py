@@ -0,0 +1,173 @@
+import socket
+import logging
+from threading import Thread
+from dataclasses import asdict
+from typing import List
+import tornado.ioloop
+from webthing import (MultipleThings, Property, Thing, Value, WebThingServer)
+from webthing.utils import get_ip
+from zeroconf import ServiceInfo, Zeroconf
+from awning import Awning
+from emergency import EmergencyRetract
+
+
+class AwningWebThing(Thing):
+
+    # regarding capabilities refer https://iot.mozilla.org/schemas
+    # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
+
+    def __init__(self, awning: Awning, emergency: EmergencyRetract = None):
+        Thing.__init__(
+            self,
+            'urn:dev:ops:anwing-TB6612FNG',
+            'awning_' + awning.name,
+            ['MultiLevelSensor'],
+            "awning control"
+        )
+        self.awning = awning
+        self.awning.add_listener(self.on_value_changed)
+
+        self.name = Value(self.awning.name)
+        self.add_property(
+            Property(self,
+                     'name',
+                     self.name,
+                     metadata={
+                         'title': 'Name',
+                         "type": "sting",
+                         'description': 'the name',
+                         'readOnly': True
+                     }))
+
+        self.position = Value(self.awning.get_position(), self.awning.set_position)
+        self.add_property(
+            Property(self,
+                     'position',
+                     self.position,
+                     metadata={
+                         '@type': 'LevelProperty',
+                         'title': 'Awning position',
+                         "type": "number",
+                         "minimum": 0,
+                         "maximum": 100,
+                         "unit": "percent",
+                         'description': 'awning position',
+                         'readOnly': False
+                     }))
+
+        self.is_target_reached = Value(self.awning.is_target_reached())
+        self.add_property(
+            Property(self,
+                     'is_target_reached',
+                     self.is_target_reached,
+                     metadata={
+                         'title': 'is_target_reached',
+                         "type": "boolean",
+                         'description': 'true, if target position is reached',
+                         'readOnly': True
+                     }))
+
+        self.current_position = Value(self.awning.get_state().current_position)
+        self.add_property(
+            Property(self,
+                     'current_position',
+                     self.current_position,
+                     metadata={
+                         '@type': 'LevelProperty',
+                         'title': 'Current awning position',
+                         "type": "number",
+                         "minimum": 0,
+                         "maximum": 100,
+                         "unit": "percent",
+                         'description': 'current awning position. Updated on motion plan changes only',
+                         'readOnly': True
+                     }))
+
+        self.motion_plan = Value(asdict(self.awning.get_motion_plan()))
+        self.add_property(
+            Property(self,
+                     'motion_plan',
+                     self.motion_plan,
+                     metadata={
+                         'title': 'motion_plan',
+                         "type": "object",
+                         'description': 'the active motion (start_position, target_position, start_time, end_time in epoch sec and sec_per_slot). Used to interpolate the current position',
+                         'readOnly': True
+                     }))
+
+        self.emergency = emergency
+        if emergency is not None:
+            self.emergency_lockout = Value(emergency.is_active, self.__set_emergency_lockout)
+            self.add_property(
+                Property(self,
+                         'emergency_lockout',
+                         self.emergency_lockout,
+                         metadata={
+                             'title': 'Emergency retract',
+                             "type": "boolean",
+                             'description': 'true retracts all awnings immediately and rejects extending until it is set to false',
+                             'readOnly': False
+                         }))
+            emergency.add_listener(self.on_emergency_changed)
+
+        self.ioloop = tornado.ioloop.IOLoop.current()
+
+    def on_value_changed(self):
+        self.ioloop.add_callback(self._on_value_changed)
+
+    def detach(self):
+        # e.g. the lane has been removed by a config reload
+        self.awning.remove_listener(self.on_value_changed)
+        if self.emergency is not None:
+            self.emergency.remove_listener(self.on_emergency_changed)
+
+    def __set_emergency_lockout(self, is_active: bool):
+        # the pins are switched at once. The retract movement is applied by the scheduler without blocking the ioloop
+        if is_active:
+            self.emergency.retract("webthing", wait_until_applied=False)
+        else:
+            self.emergency.clear("webthing")
+
+    def on_emergency_changed(self):
+        self.ioloop.add_callback(lambda: self.emergency_lockout.notify_of_external_update(self.emergency.is_active))
+
+    def _on_value_changed(self):
+        self.position.notify_of_external_update(self.awning.get_position())
+        self.is_target_reached.notify_of_external_update(self.awning.is_target_reached())
+        self.current_position.notify_of_external_update(self.awning.get_state().current_position)
+        self.motion_plan.notify_of_external_update(asdict(self.awning.get_motion_plan()))
+
+
+def create_webthing_server(awnings: List[Awning], port: int, emergency: EmergencyRetract = None) -> WebThingServer:
+    # the emergency retract is provided by the first thing, which is the group of all lanes
+    things = MultipleThings([AwningWebThing(anwing, emergency if idx == 0 else None) for idx, anwing in enumerate(awnings)], 'Awnings')
+    return WebThingServer(things, port=port, disable_host_validation=True)
+
+
+def serve_webthings(server: WebThingServer, sockets: List[socket.socket]):
+    # like WebThingServer.start(), but the pre-bound sockets are served at once. The mDNS registration takes some hundred msec and is done in the background
+    server.server.add_sockets(sockets)
+    Thread(name="webthing_mdns", target=register_mdns, args=(server,), daemon=True).start()
+    tornado.ioloop.IOLoop.current().start()
+
+
+def register_mdns(server: WebThingServer):
+    try:
+        service_info = ServiceInfo('_webthing._tcp.local.',
+                                   '{}._webthing._tcp.local.'.format(server.name),
+                                   addresses=[socket.inet_aton(get_ip())],
+                                   port=server.port,
+                                   properties={'path': '/'},
+                                   server='{}.local.'.format(socket.gethostname()))
+        zeroconf = Zeroconf()
+        zeroconf.register_service(service_info)
+        server.service_info, server.zeroconf = service_info, zeroconf
+    except Exception as e:
+        logging.warning("could not register webthing mDNS service " + str(e))
+
+
+def stop_webthings(server: WebThingServer):
+    if hasattr(server, 'zeroconf'):
+        server.zeroconf.unregister_service(server.service_info)
+        server.zeroconf.close()
+    server.server.stop()